@@ -1,4 +1,10 @@
+import io
 import json
+import struct
+import time
+import timeit
+import zlib
+from typing import Any, Callable
 
 
 class Serializable:
@@ -52,6 +58,21 @@ class BetterSerializable:
             }
         )
 
+    def serialize_binary(self):
+        """クラス名の代わりに登録時の型タグを使い, 引数をstructで詰めたバイト列にする"""
+        tag = type_tags.get(self.__class__)
+        if tag is None:
+            raise TypeError(f"{self.__class__.__name__} is not registered")
+        try:
+            codes = b"".join(ARG_CODES[type(arg)] for arg in self.args)
+        except KeyError:
+            raise TypeError(f"{self!r} has args other than int and float") from None
+        return (
+            RECORD_HEADER.pack(tag, len(self.args))
+            + codes
+            + arg_struct(codes).pack(*self.args)
+        )
+
     def __repr__(self) -> str:
         name = self.__class__.__name__
         args_str = ",".join(str(x) for x in self.args)
@@ -59,10 +80,44 @@ class BetterSerializable:
 
 
 registry = {}
+# バイナリ形式の型タグ. クラス名から決まるので, 登録やimportの順序によらない
+type_tags: dict[type, int] = {}
+tagged_classes: dict[int, type] = {}
+# 登録時にクラスごとに作っておく, NDJSONの1行の先頭とargsからの構築関数
+prefixes: dict[type, str] = {}
+decoders: dict[str, Callable[[list], Any]] = {}
+
+# deserialize_stream(), serialize_many()が一度に読み書きするおよその文字数
+STREAM_CHUNK_SIZE = 1 << 20
+
+
+def type_tag(name):
+    """クラス名からバイナリ形式の型タグ(CRC-32)を求める"""
+    return zlib.crc32(name.encode())
 
 
 def register_class(target_class):
-    registry[target_class.__name__] = target_class
+    name = target_class.__name__
+    tag = type_tag(name)
+    other = tagged_classes.get(tag)
+    if other is not None and other.__name__ != name:
+        raise ValueError(f"type tags of {name} and {other.__name__} collide")
+    registry[name] = target_class
+    type_tags[target_class] = tag
+    tagged_classes[tag] = target_class
+    prefixes[target_class] = '{"class": %s, "args": ' % json.dumps(
+        target_class.__name__
+    )
+    decoders[target_class.__name__] = make_decoder(target_class)
+
+
+def make_decoder(target_class):
+    """argsのリストからtarget_classのオブジェクトを作る関数を作る"""
+
+    def decode(args):
+        return target_class(*args)
+
+    return decode
 
 
 def deserialize(data):
@@ -72,6 +127,48 @@ def deserialize(data):
     return target_class(*params["args"])
 
 
+# バイナリ形式の1レコード: 型タグ(uint32), 引数の数(uint8),
+# 引数ごとの型コード(b"q"はint64, b"d"はdouble), structで詰めた引数
+RECORD_HEADER = struct.Struct("<IB")
+ARG_CODES = {int: b"q", float: b"d"}
+arg_structs: dict[bytes, struct.Struct] = {}
+
+
+def arg_struct(codes):
+    """型コードの並びに対応するStructを作り, 使い回す"""
+    packer = arg_structs.get(codes)
+    if packer is None:
+        packer = arg_structs[codes] = struct.Struct("<" + codes.decode())
+    return packer
+
+
+def unpack_binary(data, offset=0):
+    """offsetから1レコードを読み, オブジェクトと次のレコードの位置を返す"""
+    tag, count = RECORD_HEADER.unpack_from(data, offset)
+    offset += RECORD_HEADER.size
+    codes = bytes(data[offset : offset + count])
+    offset += count
+    packer = arg_struct(codes)
+    args = packer.unpack_from(data, offset)
+    target_class = tagged_classes.get(tag)
+    if target_class is None:
+        raise ValueError(f"unknown type tag {tag}")
+    return target_class(*args), offset + packer.size
+
+
+def deserialize_binary(data):
+    obj, _ = unpack_binary(data)
+    return obj
+
+
+def iter_deserialize_binary(data):
+    """serialize_binary()のバイト列を連結したdataから順にオブジェクトを返す"""
+    offset = 0
+    while offset < len(data):
+        obj, offset = unpack_binary(data, offset)
+        yield obj
+
+
 class EvenBetterPoint2D(BetterSerializable):
     def __init__(self, x, y) -> None:
         super().__init__(x, y)
@@ -105,6 +202,74 @@ class Vector3D(RegisteredSerializable):
     #     self.x, self.y, self.z = x, y, z
 
 
+def deserialize_stream(fileobj, chunk_size=STREAM_CHUNK_SIZE):
+    """テキストのファイルオブジェクトからNDJSONを読み, 1行ずつオブジェクトを返す
+
+    readlines()でおよそchunk_size文字ずつ読み, その行を1つのJSON配列として
+    json.loads()を1回だけ呼ぶので, 1行ごとの呼び出しのオーバーヘッドがない.
+    メモリは1チャンク分しか使わない
+    """
+    while lines := fileobj.readlines(chunk_size):
+        try:
+            chunk = json.loads("[" + ",".join(lines) + "]")
+        except json.JSONDecodeError:
+            chunk = None
+        if chunk is None or len(chunk) != len(lines):
+            # 空行や1行に複数の値がある行があれば, 1行ずつ読んで確かめる
+            chunk = [json.loads(line) for line in lines if line.strip()]
+        for params in chunk:
+            yield decoders[params["class"]](params["args"])
+
+
+def serialize_many(objs, fileobj, chunk_size=STREAM_CHUNK_SIZE):
+    """objsを1行ずつNDJSONでfileobjに書き込み, 書き込んだ数を返す
+
+    行はおよそchunk_size文字ずつまとめてwrite()する.
+    登録されていないクラスのオブジェクトはserialize()の結果をそのまま書く
+    """
+    dumps = json.dumps
+    count = 0
+    lines = []
+    size = 0
+    for obj in objs:
+        prefix = prefixes.get(obj.__class__)
+        if prefix is None:
+            line = obj.serialize() + "\n"
+        else:
+            line = f"{prefix}{dumps(obj.args)}}}\n"
+        lines.append(line)
+        size += len(line)
+        count += 1
+        if size >= chunk_size:
+            fileobj.write("".join(lines))
+            lines.clear()
+            size = 0
+    fileobj.write("".join(lines))
+    return count
+
+
+def benchmark_codecs(objs, number=1):
+    """JSONとバイナリ形式のサイズと, 書き込み・読み込みの時間を比べる"""
+    results = {}
+    json_data = [obj.serialize() for obj in objs]
+    binary_data = b"".join(obj.serialize_binary() for obj in objs)
+    results["json"] = (
+        sum(len(data) for data in json_data),
+        timeit.timeit(lambda: [obj.serialize() for obj in objs], number=number),
+        timeit.timeit(lambda: [deserialize(data) for data in json_data], number=number),
+    )
+    results["binary"] = (
+        len(binary_data),
+        timeit.timeit(
+            lambda: b"".join(obj.serialize_binary() for obj in objs), number=number
+        ),
+        timeit.timeit(
+            lambda: list(iter_deserialize_binary(binary_data)), number=number
+        ),
+    )
+    return results
+
+
 if __name__ == "__main__":
     point = Point2D(5, 3)
     print("Object ", point)
@@ -136,3 +301,51 @@ if __name__ == "__main__":
     print("Selialized ", data)
     after = deserialize(data)
     print("After ", after)
+    print("-" * 10)
+
+    # 型タグとstructを使ったバイナリ形式はJSONより小さく速い
+    vector = Vector3D(10, -7, 3)
+    data = vector.serialize_binary()
+    print("Serialized ", data)
+    after = deserialize_binary(data)
+    print("After ", after)
+    objs: list[BetterSerializable] = [
+        EvenBetterPoint2D(i, i * 0.5) for i in range(500_000)
+    ]
+    objs += [Vector3D(i, -i, 3) for i in range(500_000)]
+    for codec, (size, encode, decode) in benchmark_codecs(objs).items():
+        print(
+            f"{codec:>6}: {size / len(objs):.1f} bytes/object, "
+            f"encode {encode:.2f}s, decode {decode:.2f}s"
+        )
+    #   json: 53.9 bytes/object, encode 5.49s, decode 4.83s
+    # binary: 27.5 bytes/object, encode 2.14s, decode 2.69s
+    print("-" * 10)
+
+    # NDJSONをまとめて読み書きすると, 1行ずつの呼び出しより速い
+    buffer = io.StringIO()
+    start = time.perf_counter()
+    for obj in objs:
+        buffer.write(obj.serialize() + "\n")
+    one_by_one = time.perf_counter() - start
+    buffer = io.StringIO()
+    start = time.perf_counter()
+    serialize_many(objs, buffer)
+    many = time.perf_counter() - start
+    print(f"write: one by one {one_by_one:.2f}s, serialize_many {many:.2f}s")
+
+    # 読み込んだオブジェクトは捨てるので, 大量のオブジェクトが残らないようにする
+    del objs
+    buffer.seek(0)
+    start = time.perf_counter()
+    for line in buffer:
+        deserialize(line)
+    one_by_one = time.perf_counter() - start
+    buffer.seek(0)
+    start = time.perf_counter()
+    for obj in deserialize_stream(buffer):
+        pass
+    stream = time.perf_counter() - start
+    print(f"read: one by one {one_by_one:.2f}s, deserialize_stream {stream:.2f}s")
+    # write: one by one 4.18s, serialize_many 2.61s
+    # read: one by one 3.62s, deserialize_stream 2.01s
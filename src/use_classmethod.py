@@ -1,7 +1,65 @@
+import asyncio
+import bz2
+import copy
+import gzip
+import heapq
+import io
+import json
+import lzma
+import multiprocessing
 import os
+import pickle
+import platform
+import queue
 import random
-from threading import Thread
-from typing import Generator, Iterable, Optional
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import (FIRST_COMPLETED, Executor, Future,
+                                ProcessPoolExecutor, ThreadPoolExecutor, wait)
+from fnmatch import fnmatch
+from itertools import groupby
+from multiprocessing.managers import BaseManager
+from multiprocessing.shared_memory import SharedMemory
+from operator import itemgetter
+from typing import (Any, Callable, Generator, Hashable, Iterable, Iterator,
+                    Optional, Union)
+from urllib.parse import urlsplit
+
+# read_chunks()で1度に読み込むバイト数
+CHUNK_SIZE = 1 << 20
+# ShardedPathInputDataで1つのワーカーが担当するバイト数の目安
+SHARD_SIZE = 64 << 20
+# 圧縮形式ごとのファイルを開く関数, 拡張子, 先頭のマジックバイト
+CODECS: dict[str, tuple[Callable[..., Any], str, bytes]] = {
+    "gzip": (gzip.open, ".gz", b"\x1f\x8b"),
+    "bz2": (bz2.open, ".bz2", b"BZh"),
+    "xz": (lzma.open, ".xz", b"\xfd7zXZ\x00"),
+}
+# k-way mergeで同時に開くスピルファイル数の上限
+MERGE_FAN_IN = 64
+# 投機的実行 : 提出したmapのうちこの割合が終わったら遅いmapの複製を検討する
+SPECULATION_QUANTILE = 0.75
+# 中央値の何倍より長くかかっているmapを遅いとみなすか
+SPECULATION_FACTOR = 2.0
+# 投機的実行のために実行中のmapを確認する間隔(秒)
+SPECULATION_INTERVAL = 0.05
+# mapreduce_cluster()でキューを確認する間隔(秒)
+CLUSTER_POLL_INTERVAL = 0.5
+# run_node()が生存を通知する間隔(秒)
+CLUSTER_HEARTBEAT_INTERVAL = 1.0
+# HTTPInputDataが1回の取得を待つ秒数
+HTTP_TIMEOUT = 30.0
+# write_dataset()で生成する行に使う単語
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua"
+).split()
 
 
 class GenericInputData:
@@ -15,6 +73,30 @@ class GenericInputData:
         """
         raise NotImplementedError
 
+    def read_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """Read the input data as binary blocks.
+
+        Each block is a memoryview whose buffer may be reused, so a block is
+        valid only until the next one is requested. The default implementation encodes
+        the result of read() for subclasses that only support text.
+
+        Args:
+            chunk_size (int): maximum number of bytes in each block
+
+        Yields:
+            Iterator[memoryview]: block of the input data
+        """
+        yield memoryview(self.read().encode())
+
+    def cache_key(self) -> Optional[Hashable]:
+        """Get the key identifying this input and its content for ResultCache.
+
+        Returns:
+            Optional[Hashable]: key which changes when the input changes, or
+            None if the input must not be cached
+        """
+        return None
+
     @classmethod
     def generate_inputs(cls, config: dict[str, str]) -> Iterable["GenericInputData"]:
         """Generate input data instances based on the given configuration.
@@ -28,9 +110,11 @@ class GenericInputData:
 class PathInputData(GenericInputData):
     """Concrete class of InputData"""
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, stat: Optional[os.stat_result] = None) -> None:
         super().__init__()
         self.path = path
+        # 探索時に取得したstatを再利用し, ファイルごとのstat呼び出しを省く
+        self.stat = stat
 
     def read(self) -> str:
         """Read the content of the file specified by self.path.
@@ -41,24 +125,490 @@ class PathInputData(GenericInputData):
         with open(self.path) as f:
             return f.read()
 
+    def read_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """Read the file specified by self.path as binary blocks without
+        decoding.
+
+        Args:
+            chunk_size (int): maximum number of bytes in each block
+
+        Yields:
+            Iterator[memoryview]: view of a buffer reused for every block
+        """
+        # readinto()で同じbytearrayに読み込み, コピーせずにmemoryviewで渡す
+        with open(self.path, "rb", buffering=0) as f:
+            remaining = (self.stat or os.fstat(f.fileno())).st_size
+            # バッファはファイルより大きく取らず, 最後のブロックも残りの大きさで読むので,
+            # ブロックは普通バッファ全体になり count_newlines()がコピーせずに数えられる
+            buffer = bytearray(min(chunk_size, remaining or chunk_size))
+            while True:
+                if 0 < remaining < len(buffer):
+                    buffer = bytearray(remaining)
+                if not (size := f.readinto(buffer)):
+                    return
+                remaining -= size
+                view = memoryview(buffer)
+                yield view if size == len(buffer) else view[:size]
+
+    def cache_key(self) -> Optional[Hashable]:
+        """Get the key identifying the file and its content.
+
+        The class is part of the key, so subclasses which read the same file
+        differently, e.g. CompressedPathInputData, don't share results.
+
+        Returns:
+            Optional[Hashable]: class, path, size, mtime and inode of the file
+        """
+        st = self.stat or os.stat(self.path)
+        cls = type(self)
+        return (
+            cls.__module__,
+            cls.__qualname__,
+            self.path,
+            st.st_size,
+            st.st_mtime_ns,
+            st.st_ino,
+        )
+
     @classmethod
     def generate_inputs(cls, config: dict[str, str]) -> Iterable["PathInputData"]:
         """Generate PathInputData instances based on the given configuration.
 
+        See discover_files() for the options of config.
+
         Yields:
             Iterable[PathInputData]: Instances of PathInputData.
         """
-        data_dir = config["data_dir"]
-        for name in os.listdir(data_dir):
-            yield cls(os.path.join(data_dir, name))
+        for entry in discover_files(config):
+            yield cls(entry.path, entry.stat())
+
+
+class ShardedPathInputData(PathInputData):
+    """InputData of a byte range of a file split at newline boundaries"""
+
+    def __init__(
+        self,
+        path: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> None:
+        super().__init__(path, stat)
+        if end is None:
+            end = (stat or os.stat(path)).st_size
+        self.start = start
+        self.end = end
+
+    def read(self) -> str:
+        """Read the byte range of the file specified by self.path.
+
+        Returns:
+            str: content of the byte range.
+        """
+        with open(self.path, "rb") as f:
+            f.seek(self.start)
+            return f.read(self.end - self.start).decode()
+
+    def read_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """Read the byte range of the file as binary blocks.
+
+        Args:
+            chunk_size (int): maximum number of bytes in each block
+
+        Yields:
+            Iterator[memoryview]: view of a buffer reused for every block
+        """
+        remaining = self.end - self.start
+        buffer = bytearray(min(chunk_size, remaining))
+        with open(self.path, "rb", buffering=0) as f:
+            f.seek(self.start)
+            while remaining > 0:
+                # 最後のブロックも残りの大きさのバッファ全体に読む (PathInputDataと同じ)
+                if remaining < len(buffer):
+                    buffer = bytearray(remaining)
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                remaining -= size
+                view = memoryview(buffer)
+                yield view if size == len(buffer) else view[:size]
+
+    def cache_key(self) -> Optional[Hashable]:
+        """Get the key identifying the byte range and the file content.
+
+        Returns:
+            Optional[Hashable]: class, path, byte range, size, mtime and inode
+        """
+        st = self.stat or os.stat(self.path)
+        cls = type(self)
+        return (
+            cls.__module__,
+            cls.__qualname__,
+            self.path,
+            self.start,
+            self.end,
+            st.st_size,
+            st.st_mtime_ns,
+            st.st_ino,
+        )
+
+    @classmethod
+    def split(
+        cls, path: str, shard_size: int, stat: Optional[os.stat_result] = None
+    ) -> Iterator["ShardedPathInputData"]:
+        """Split a file into byte ranges of about shard_size bytes.
+
+        Each range ends just after a newline, so no line is split across
+        two shards.
+
+        Args:
+            path (str): file path
+            shard_size (int): approximate number of bytes of each shard
+            stat (Optional[os.stat_result]): stat of the file if already known
+
+        Yields:
+            Iterator[ShardedPathInputData]: Instances for each byte range.
+        """
+        stat = stat or os.stat(path)
+        size = stat.st_size
+        start = 0
+        with open(path, "rb") as f:
+            while start < size:
+                end = start + shard_size
+                # 次の改行まで進めて行の途中で分割しないようにする
+                f.seek(end)
+                while chunk := f.read(CHUNK_SIZE):
+                    index = chunk.find(b"\n")
+                    if index >= 0:
+                        end += index + 1
+                        break
+                    end += len(chunk)
+                end = min(end, size)
+                yield cls(path, start, end, stat)
+                start = end
+
+    @classmethod
+    def generate_inputs(
+        cls, config: dict[str, str]
+    ) -> Iterable["ShardedPathInputData"]:
+        """Generate ShardedPathInputData instances based on the given
+        configuration.
+
+        Files larger than config["shard_size"] (defaults to SHARD_SIZE) are
+        split into several shards so that each one becomes its own worker.
+        See discover_files() for the other options of config.
+
+        Yields:
+            Iterable[ShardedPathInputData]: Instances of ShardedPathInputData.
+        """
+        shard_size = int(config.get("shard_size", SHARD_SIZE))
+        for entry in discover_files(config):
+            yield from cls.split(entry.path, shard_size, entry.stat())
+
+
+class CompressedPathInputData(PathInputData):
+    """InputData of a file which may be compressed with gzip, bz2 or xz"""
+
+    def open(self) -> io.BufferedIOBase:
+        """Open the file, decompressing it if it is compressed.
+
+        Returns:
+            io.BufferedIOBase: binary file object of the decompressed content
+        """
+        codec = detect_codec(self.path)
+        if codec is None:
+            return open(self.path, "rb")
+        return CODECS[codec][0](self.path, "rb")
+
+    def read(self) -> str:
+        """Read the decompressed content of the file.
+
+        Returns:
+            str: decompressed content of the file.
+        """
+        with self.open() as f:
+            return f.read().decode()
+
+    def read_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """Read the decompressed content of the file as binary blocks.
+
+        The whole file is never decompressed at once. Decompression runs in
+        the map step, so it overlaps across files on the executor.
+
+        Args:
+            chunk_size (int): maximum number of bytes in each block
+
+        Yields:
+            Iterator[memoryview]: view of a buffer reused for every block
+        """
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        with self.open() as f:
+            while size := f.readinto(buffer):
+                yield view[:size]
+
+
+def detect_codec(path: str) -> Optional[str]:
+    """Detect the compression format of a file
+
+    The extension is checked first, then the magic bytes at the head.
+
+    Args:
+        path (str): file path
+
+    Returns:
+        Optional[str]: key of CODECS, or None if the file is not compressed
+    """
+    for codec, (_, extension, _) in CODECS.items():
+        if path.endswith(extension):
+            return codec
+    with open(path, "rb") as f:
+        head = f.read(6)
+    for codec, (_, _, magic) in CODECS.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def scan_files(
+    data_dir: str,
+    recursive: bool = False,
+    include: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+) -> Iterator[os.DirEntry]:
+    """Walk data_dir with os.scandir and yield regular files
+
+    Patterns are matched with fnmatch against the path relative to data_dir.
+    Excluded directories are not walked. As with os.walk(), symbolic links to
+    directories are not followed, so a link cycle can't loop forever.
+
+    Args:
+        data_dir (str): dir path
+        recursive (bool): whether to walk subdirectories
+        include (Iterable[str]): glob patterns of files to yield. All files
+        are yielded if empty.
+        exclude (Iterable[str]): glob patterns of files and directories to skip
+
+    Yields:
+        Iterator[os.DirEntry]: entry of each file. Its stat() is cached.
+    """
+    include, exclude = list(include), list(exclude)
+    stack = [(data_dir, "")]
+    while stack:
+        dir_path, prefix = stack.pop()
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                relpath = prefix + entry.name
+                if any(fnmatch(relpath, pattern) for pattern in exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append((entry.path, relpath + "/"))
+                elif entry.is_file():
+                    if not include or any(fnmatch(relpath, p) for p in include):
+                        yield entry
+
+
+def discover_files(config: dict[str, str]) -> Iterator[os.DirEntry]:
+    """Find input files based on the given configuration.
+
+    Args:
+        config (dict[str, str]): Configuration containing data directory path
+        ("data_dir") and optionally "recursive" ("true" to walk
+        subdirectories), "include" and "exclude" (comma separated glob
+        patterns) and "order" ("largest_first").
+
+    Yields:
+        Iterator[os.DirEntry]: entry of each input file
+    """
+    entries = scan_files(
+        config["data_dir"],
+        recursive=config_flag(config, "recursive"),
+        include=split_patterns(config.get("include", "")),
+        exclude=split_patterns(config.get("exclude", "")),
+    )
+    if config.get("order") == "largest_first":
+        # 大きいファイルから処理すると, 最後に大きなmapだけが残るのを防げる
+        # 並べ替えのためにエントリを全て読み込む
+        yield from sorted(entries, key=lambda e: e.stat().st_size, reverse=True)
+    else:
+        yield from entries
+
+
+def config_flag(config: dict[str, str], key: str) -> bool:
+    """Get a boolean option of config
+
+    Args:
+        config (dict[str, str]): Configuration
+        key (str): name of the option
+
+    Returns:
+        bool: True if the option is "1", "true" or "yes"
+    """
+    return config.get(key, "").lower() in ("1", "true", "yes")
+
+
+def split_patterns(patterns: str) -> list[str]:
+    """Split comma separated glob patterns
+
+    Args:
+        patterns (str): e.g. "*.log,*.txt"
+
+    Returns:
+        list[str]: non-empty patterns
+    """
+    return [pattern.strip() for pattern in patterns.split(",") if pattern.strip()]
+
+
+class LoadedInputData(GenericInputData):
+    """InputData whose content is already in memory"""
+
+    def __init__(self, data: str) -> None:
+        super().__init__()
+        self.data = data
+
+    def read(self) -> str:
+        """Return the content.
+
+        Returns:
+            str: content of the input.
+        """
+        return self.data
+
+
+class AsyncInputData(GenericInputData):
+    """Generic class of InputData read with asyncio"""
+
+    async def read(self) -> str:  # type: ignore[override]
+        """Read the input data without blocking the event loop.
+
+        Raises:
+            NotImplementedError: This method must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    def read_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """AsyncInputData can't be read synchronously.
+
+        Raises:
+            TypeError: Always, use mapreduce_async() or execute_async().
+        """
+        raise TypeError(f"{self.__class__.__name__} is async, use mapreduce_async()")
+
+
+def check_sync_input(input_class: type[GenericInputData]) -> None:
+    """Fail fast when a synchronous driver is given AsyncInputData.
+
+    Args:
+        input_class (type[GenericInputData]): input class of the job
+
+    Raises:
+        TypeError: If input_class is a subclass of AsyncInputData.
+    """
+    if issubclass(input_class, AsyncInputData):
+        raise TypeError(f"{input_class.__name__} is async, use mapreduce_async()")
+
+
+class AsyncPathInputData(AsyncInputData):
+    """AsyncInputData of a file, e.g. on a network-mounted directory"""
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+
+    async def read(self) -> str:  # type: ignore[override]
+        """Read the content of the file in a thread of the default executor.
+
+        Returns:
+            str: content of the file.
+        """
+        return await asyncio.to_thread(PathInputData(self.path).read)
+
+    @classmethod
+    def generate_inputs(cls, config: dict[str, str]) -> Iterable["AsyncPathInputData"]:
+        """Generate AsyncPathInputData instances based on the given
+        configuration. See discover_files() for the options of config.
+
+        Yields:
+            Iterable[AsyncPathInputData]: Instances of AsyncPathInputData.
+        """
+        for entry in discover_files(config):
+            yield cls(entry.path)
+
+
+class HTTPInputData(AsyncInputData):
+    """AsyncInputData of a document fetched with HTTP GET"""
+
+    def __init__(self, url: str, timeout: float = HTTP_TIMEOUT) -> None:
+        super().__init__()
+        # TLSは実装していないので, httpsを平文で送らないようにする
+        if urlsplit(url).scheme != "http":
+            raise ValueError(f"unsupported URL scheme, only http: {url}")
+        self.url = url
+        self.timeout = timeout
+
+    async def read(self) -> str:  # type: ignore[override]
+        """Fetch the document with a HTTP/1.0 GET request.
+
+        Returns:
+            str: body of the response.
+
+        Raises:
+            OSError: If the server does not respond with status 200.
+            TimeoutError: If the response is not complete within timeout
+            seconds.
+        """
+        return await asyncio.wait_for(self.fetch(), self.timeout)
+
+    async def fetch(self) -> str:
+        """Fetch the document without a timeout, see read().
+
+        Returns:
+            str: body of the response.
+        """
+        url = urlsplit(self.url)
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        try:
+            target = url.path or "/"
+            if url.query:
+                target += "?" + url.query
+            request = f"GET {target} HTTP/1.0\r\nHost: {url.netloc}\r\n\r\n"
+            writer.write(request.encode())
+            await writer.drain()
+            # HTTP/1.0ではサーバーが接続を閉じるまでがレスポンス
+            response = await reader.read()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        header, _, body = response.partition(b"\r\n\r\n")
+        status = header.split(b"\r\n", 1)[0].decode()
+        if status.split()[1:2] != ["200"]:
+            raise OSError(f"GET {self.url} failed: {status}")
+        return body.decode()
+
+    @classmethod
+    def generate_inputs(cls, config: dict[str, str]) -> Iterable["HTTPInputData"]:
+        """Generate HTTPInputData instances based on the given configuration.
+
+        Yields:
+            Iterable[HTTPInputData]: Instances for each of the comma separated
+            config["urls"].
+        """
+        for url in split_patterns(config["urls"]):
+            yield cls(url)
 
 
 class GenericWorker:
     """Worker of processing input data"""
 
+    # map()の処理内容を変えたら上げて, キャッシュ済みの結果を無効にする
+    version = 1
+    # Trueなら同じ入力のmapを複数回実行してよい(投機的実行の対象になる)
+    idempotent = False
+
     def __init__(self, input_data: GenericInputData) -> None:
         self.input_data = input_data
-        self.result = 0
+        self.result: Any = 0
 
     def map(self) -> None:
         """Perform the mapping step of processing.
@@ -99,20 +649,41 @@ class GenericWorker:
             NotImplementedError: If the input class does not support
             generate_inputs method.
         """
-        workers = []
+        return list(cls.generate_workers(input_class, config))
+
+    @classmethod
+    def generate_workers(
+        cls, input_class: type[GenericInputData], config: dict[str, str]
+    ) -> Iterator["GenericWorker"]:
+        """Generate workers lazily based on the provided input class and
+        configuration.
+
+        Args:
+            input_class (GenericInputData): The input data class to be used
+            for generating inputs.
+            config (Dict[str, str]): Configuration containing data directory
+            path.
+
+        Yields:
+            Iterator[GenericWorker]: worker instance for each input
+        """
         # cls()で新しいGenericWorkerインスタンスを作る
+        # 入力を1つずつ取り出すのでリストを作らない
         for input_data in input_class.generate_inputs(config):
-            workers.append(cls(input_data))
-        return workers
+            yield cls(input_data)
 
 
 class LineCountWorker(GenericWorker):
     """Concrete class of Worker"""
 
+    idempotent = True
+
     def map(self) -> None:
         """Count the number of lines in a file"""
-        data = self.input_data.read()
-        self.result = data.count("\n")
+        # 文字列にデコードせず, ブロックごとにb"\n"を数えるのでメモリ使用量は一定
+        self.result = 0
+        for chunk in self.input_data.read_chunks():
+            self.result += count_newlines(chunk)
 
     def reduce(self, other: "LineCountWorker") -> None:  # type: ignore[override]
         """Aggregate the number of lines in file
@@ -124,99 +695,1726 @@ class LineCountWorker(GenericWorker):
             self.result += other.result
 
 
-def generate_inputs(data_dir: str) -> Generator[PathInputData, None, None]:
-    """Get file path from args dir
-
-    Args:
-        data_dir (str): dir path
+class LineLengthHistogramWorker(GenericWorker):
+    """Worker counting lines by the bit length of their length
 
-    Yields:
-        Generator[PathInputData, None, None]: PathInputData object of each
-        file content
+    The result is a list of `width` counts. The k-th count is the number of
+    lines whose length needs k bits, and the last one also counts longer
+    lines.
     """
-    for name in os.listdir(data_dir):
-        yield PathInputData(os.path.join(data_dir, name))
-
 
-def create_workers(input_list: Iterable[GenericInputData]) -> list[LineCountWorker]:
-    """Create list of workers
+    idempotent = True
+    width = 16
 
-    Args:
-        input_list (Iterable[GenericInputData]): iterable object of
-        GenericInputData instance
+    def map(self) -> None:
+        """Count the lines of a file by their length"""
+        self.result = [0] * self.width
+        last = self.width - 1
+        for line in self.input_data.read().splitlines():
+            self.result[min(len(line).bit_length(), last)] += 1
 
-    Returns:
-        list[LineCountWorker]: list of LineCountWorker instance
-    """
-    workers = []
-    for input_data in input_list:
-        workers.append(LineCountWorker(input_data))
-    return workers
+    def reduce(  # type: ignore[override]
+        self, other: "LineLengthHistogramWorker"
+    ) -> None:
+        """Add the counts of other
 
+        Args:
+            other (LineLengthHistogramWorker): worker to be aggregated
+        """
+        self.result = [a + b for a, b in zip(self.result, other.result)]
 
-def execute(workers: list[GenericWorker]) -> Optional[int]:
-    """Execute MapReduce model
 
-    Args:
-        workers (list[GenericWorker]): Workers to execute
+class KeyValueWorker(GenericWorker):
+    """Worker whose map step emits key/value pairs
 
-    Returns:
-        Optional[int]: Total count of lines in files
+    Pairs are combined per worker, hash partitioned into `partitions`
+    reducers and spilled to sorted run files whenever more than `max_keys`
+    keys are buffered. The result of the map step is the list of run files
+    of each partition, so only file paths are reduced between workers.
     """
-    # Map step
-    # workersリストの各LineCountWorkerオブジェクトをマッピングする
-    threads = [Thread(target=w.map) for w in workers]
-    # 各ファイルの行数を並列に数える
-    for thread in threads:
-        thread.start()  # 処理開始
-    for thread in threads:
-        thread.join()  # 処理終了を待つ
 
-    # Reduce step
-    # 1番目のLineCountWorker.reduce()で集計を行う
-    first, *rest = workers
-    for worker in rest:
-        first.reduce(worker)
-    return first.result
+    partitions = 4
+    max_keys = 100_000
 
+    def __init__(self, input_data: GenericInputData) -> None:
+        super().__init__(input_data)
+        self.spill_dir = tempfile.gettempdir()
 
-def mapreduce(
-    worker_class: type[GenericWorker],
-    input_class: type[GenericInputData],
-    config: dict[str, str],
-) -> Optional[int]:
-    """Execute the MapReduce process using the provided worker class, input
-    class, and configuration.
+    def map_pairs(self) -> Iterable[tuple[Hashable, Any]]:
+        """Emit key/value pairs of the input data.
 
-    Args:
-        worker_class (type[GenericWorker]): The worker class responsible for
-        processing input data.
-        input_class (type[GenericInputData]): The input data class to be used for
-        generating inputs.
-        config (dict[str, str]): Configuration containing data directory path.
+        Raises:
+            NotImplementedError: This method must be implemented by subclasses.
+        """
+        raise NotImplementedError
 
-    Returns:
-        Optional[int]: The total count of lines in the files processed by the
-        MapReduce process, or None if the process fails.
+    @classmethod
+    def combine(cls, key: Hashable, values: Iterable[Any]) -> Any:
+        """Combine values of the same key into one value.
 
-    Raises:
-        NotImplementedError: If the worker class or input class does not
-        support the required methods.
-    """
-    workers = worker_class.create_workers(input_class, config)
-    return execute(workers)
+        This is used both as the per-worker combiner and as the reducer, so
+        it must be associative.
 
+        Raises:
+            NotImplementedError: This method must be implemented by subclasses.
+        """
+        raise NotImplementedError
 
-def write_test_files(tmpdir: str) -> None:
-    """Generate sample file for test MapReduce
+    @classmethod
+    def generate_workers(
+        cls, input_class: type[GenericInputData], config: dict[str, str]
+    ) -> Iterator["KeyValueWorker"]:
+        """Generate workers lazily and apply the shuffle settings of config.
+
+        Args:
+            input_class (GenericInputData): The input data class to be used
+            for generating inputs.
+            config (Dict[str, str]): Configuration containing data directory
+            path, and optionally "spill_dir", "partitions" and "max_keys".
+
+        Yields:
+            Iterator[KeyValueWorker]: worker instance for each input
+        """
+        for worker in super().generate_workers(input_class, config):
+            assert isinstance(worker, KeyValueWorker)
+            worker.spill_dir = config.get("spill_dir", worker.spill_dir)
+            worker.partitions = int(config.get("partitions", cls.partitions))
+            worker.max_keys = int(config.get("max_keys", cls.max_keys))
+            yield worker
+
+    def map(self) -> None:
+        """Combine emitted pairs and spill them to sorted run files"""
+        self.result = [[] for _ in range(self.partitions)]
+        buffer: dict[Hashable, Any] = {}
+        for key, value in self.map_pairs():
+            # Combiner : 同じキーの値をワーカー内で先に集約しておく
+            if key in buffer:
+                buffer[key] = self.combine(key, (buffer[key], value))
+            else:
+                buffer[key] = value
+            # メモリ予算を超えたらディスクに書き出す
+            if len(buffer) >= self.max_keys:
+                self.spill(buffer)
+                buffer.clear()
+        if buffer:
+            self.spill(buffer)
+
+    def spill(self, buffer: dict[Hashable, Any]) -> None:
+        """Write buffered pairs to one sorted run file per partition.
+
+        Args:
+            buffer (dict[Hashable, Any]): combined pairs to write
+        """
+        by_partition: list[list[tuple[Hashable, Any]]] = [
+            [] for _ in range(self.partitions)
+        ]
+        for pair in buffer.items():
+            by_partition[partition_of(pair[0], self.partitions)].append(pair)
+        for runs, pairs in zip(self.result, by_partition):
+            if pairs:
+                pairs.sort(key=itemgetter(0))
+                runs.append(write_pairs(pairs, self.spill_dir))
+
+    def reduce(self, other: "KeyValueWorker") -> None:  # type: ignore[override]
+        """Gather run files of each partition
+
+        Args:
+            other (KeyValueWorker): KeyValueWorker object to be aggregated
+        """
+        for runs, other_runs in zip(self.result, other.result):
+            runs.extend(other_runs)
+
+
+class WordCountWorker(KeyValueWorker):
+    """Concrete class of KeyValueWorker"""
+
+    def map_pairs(self) -> Iterable[tuple[str, int]]:
+        """Emit each word in a file with count 1"""
+        for word in self.input_data.read().split():
+            yield word, 1
+
+    @classmethod
+    def combine(cls, key: Hashable, values: Iterable[int]) -> int:
+        """Sum the counts of a word"""
+        return sum(values)
+
+
+def partition_of(key: Hashable, partitions: int) -> int:
+    """Get the partition of key
+
+    hash()はプロセスごとにランダム化されるため, reprのCRC32で振り分ける.
+
+    Args:
+        key (Hashable): key with a stable repr
+        partitions (int): number of partitions
+
+    Returns:
+        int: partition index from 0 to partitions - 1
+    """
+    return zlib.crc32(repr(key).encode()) % partitions
+
+
+def write_pairs(pairs: Iterable[tuple[Hashable, Any]], spill_dir: str) -> str:
+    """Write key/value pairs to a new run file
+
+    Args:
+        pairs (Iterable[tuple[Hashable, Any]]): pairs sorted by key
+        spill_dir (str): dir path of run files
+
+    Returns:
+        str: path of the run file
+    """
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=spill_dir, suffix=".run", delete=False
+    ) as f:
+        for pair in pairs:
+            pickle.dump(pair, f)
+    return f.name
+
+
+def read_pairs(path: str) -> Iterator[tuple[Hashable, Any]]:
+    """Read key/value pairs written by write_pairs() or merge_partition()
+
+    Args:
+        path (str): path of the run or output file
+
+    Yields:
+        Iterator[tuple[Hashable, Any]]: pair in the file
+    """
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def merge_runs(
+    worker_class: type[KeyValueWorker], runs: list[str]
+) -> Iterator[tuple[Hashable, Any]]:
+    """Merge sorted run files and combine the values of each key
+
+    Args:
+        worker_class (type[KeyValueWorker]): class providing combine()
+        runs (list[str]): paths of sorted run files
+
+    Yields:
+        Iterator[tuple[Hashable, Any]]: combined pairs sorted by key
+    """
+    # k-way merge : ソート済みの各ファイルを先頭から少しずつ読み込んで併合する
+    merged = heapq.merge(*(read_pairs(path) for path in runs), key=itemgetter(0))
+    for key, group in groupby(merged, key=itemgetter(0)):
+        yield key, worker_class.combine(key, (value for _, value in group))
+
+
+def merge_partition(
+    worker_class: type[KeyValueWorker], runs: list[str], output_path: str
+) -> str:
+    """Reduce one partition by merging its run files into output_path
+
+    Run files are merged at most MERGE_FAN_IN at a time and removed
+    afterwards.
+
+    Args:
+        worker_class (type[KeyValueWorker]): class providing combine()
+        runs (list[str]): paths of sorted run files of the partition
+        output_path (str): path of the reduced output
+
+    Returns:
+        str: output_path
+    """
+    spill_dir = os.path.dirname(output_path)
+    # 開くファイル数を抑えるため, 多すぎる場合は中間ファイルにまとめる
+    while len(runs) > MERGE_FAN_IN:
+        batch, runs = runs[:MERGE_FAN_IN], runs[MERGE_FAN_IN:]
+        runs.append(write_pairs(merge_runs(worker_class, batch), spill_dir))
+        for path in batch:
+            os.remove(path)
+    with open(output_path, "wb") as f:
+        for pair in merge_runs(worker_class, runs):
+            pickle.dump(pair, f)
+    for path in runs:
+        os.remove(path)
+    return output_path
+
+
+def count_newlines(chunk: memoryview) -> int:
+    """Count newlines in a block yielded by read_chunks()
+
+    Args:
+        chunk (memoryview): block of bytes
+
+    Returns:
+        int: number of newlines in the block
+    """
+    # memoryviewはcount()を持たないため, バッファ全体を指すならコピーせずに数える
+    # 一部を指すviewは元のバッファ内の位置が分からないので, コピーして数える.
+    # PathInputDataなどはブロックがバッファ全体になるよう読むので, 普通コピーしない
+    whole = chunk.obj
+    if isinstance(whole, (bytes, bytearray)) and chunk.nbytes == len(whole):
+        return whole.count(b"\n")
+    return chunk.tobytes().count(b"\n")
+
+
+def generate_inputs(data_dir: str) -> Generator[PathInputData, None, None]:
+    """Get file path from args dir
+
+    Args:
+        data_dir (str): dir path
+
+    Yields:
+        Generator[PathInputData, None, None]: PathInputData object of each
+        file content
+    """
+    for name in os.listdir(data_dir):
+        yield PathInputData(os.path.join(data_dir, name))
+
+
+def create_workers(input_list: Iterable[GenericInputData]) -> list[LineCountWorker]:
+    """Create list of workers
+
+    Args:
+        input_list (Iterable[GenericInputData]): iterable object of
+        GenericInputData instance
+
+    Returns:
+        list[LineCountWorker]: list of LineCountWorker instance
+    """
+    workers = []
+    for input_data in input_list:
+        workers.append(LineCountWorker(input_data))
+    return workers
+
+
+class SerialExecutor(Executor):
+    """Executor that runs every submitted call in the calling thread"""
+
+    def submit(self, fn: Callable, /, *args: Any, **kwargs: Any) -> Future:
+        """Run fn immediately and wrap its outcome in a completed Future.
+
+        Args:
+            fn (Callable): callable to run
+
+        Returns:
+            Future: future which already holds the result or the exception
+        """
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+# executor引数に文字列で指定できる実行方式
+EXECUTORS: dict[str, Callable[[Optional[int]], Executor]] = {
+    "serial": lambda max_workers: SerialExecutor(),
+    "thread": lambda max_workers: ThreadPoolExecutor(max_workers),
+    "process": lambda max_workers: ProcessPoolExecutor(max_workers),
+}
+
+
+def create_executor(
+    executor: Union[str, Executor], max_workers: Optional[int] = None
+) -> Executor:
+    """Create an executor from its name, or return the given executor as is
+
+    Args:
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance
+        max_workers (Optional[int]): Maximum number of workers of the pool
+
+    Returns:
+        Executor: executor to run the map step
+
+    Raises:
+        ValueError: If the name of executor is unknown.
+    """
+    if isinstance(executor, Executor):
+        return executor
+    try:
+        factory = EXECUTORS[executor]
+    except KeyError:
+        raise ValueError(f"Unknown executor: {executor!r}") from None
+    return factory(max_workers)
+
+
+def run_map(worker: GenericWorker) -> Any:
+    """Run the map step of worker and return only its result
+
+    ProcessPoolExecutorでは戻り値だけがプロセス境界を越えて親に返される.
+
+    Args:
+        worker (GenericWorker): worker to map
+
+    Returns:
+        Any: result of the map step
+    """
+    worker.map()
+    return worker.result
+
+
+def run_reduce(left: GenericWorker, right: GenericWorker) -> GenericWorker:
+    """Reduce right into left and return left
+
+    Args:
+        left (GenericWorker): worker of the earlier inputs
+        right (GenericWorker): worker of the later inputs
+
+    Returns:
+        GenericWorker: left holding the reduced result
+    """
+    left.reduce(right)
+    return left
+
+
+# 1つのmapの計測結果. 時間の単位は秒
+WorkerStats = namedtuple(
+    "WorkerStats",
+    ("name", "queue_wait", "wall_time", "cpu_time", "read_time", "bytes_read"),
+)
+
+
+class InstrumentedInputData(GenericInputData):
+    """InputData measuring the time and size of reads of another InputData
+
+    Other attributes, e.g. path, are those of the wrapped input data.
+    """
+
+    def __init__(self, input_data: GenericInputData) -> None:
+        super().__init__()
+        self.input_data = input_data
+        self.read_time = 0.0
+        self.bytes_read = 0
+
+    def __getattr__(self, name: str) -> Any:
+        # 属性が見つからないときだけ呼ばれる. unpickle中はinput_dataもまだない
+        if name == "input_data":
+            raise AttributeError(name)
+        return getattr(self.input_data, name)
+
+    def read(self) -> str:
+        """Read the wrapped input data.
+
+        Returns:
+            str: content of the input. Its size in UTF-8 is counted as
+            bytes_read.
+        """
+        start = time.perf_counter()
+        data = self.input_data.read()
+        self.read_time += time.perf_counter() - start
+        self.bytes_read += len(data) if data.isascii() else len(data.encode())
+        return data
+
+    def read_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """Read the wrapped input data as binary blocks.
+
+        Args:
+            chunk_size (int): maximum number of bytes in each block
+
+        Yields:
+            Iterator[memoryview]: block of the wrapped input data
+        """
+        chunks = self.input_data.read_chunks(chunk_size)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            self.read_time += time.perf_counter() - start
+            if chunk is None:
+                return
+            self.bytes_read += chunk.nbytes
+            yield chunk
+
+    def cache_key(self) -> Optional[Hashable]:
+        """Get the key of the wrapped input data.
+
+        Returns:
+            Optional[Hashable]: key of the wrapped input data
+        """
+        return self.input_data.cache_key()
+
+
+def run_map_timed(worker: GenericWorker, submitted: float) -> tuple[Any, WorkerStats]:
+    """Run the map step of worker and measure it
+
+    perf_counter()はLinuxではシステム全体で共通の単調時計なので,
+    別プロセスで測った時刻との差から待ち時間を求められる.
+
+    Args:
+        worker (GenericWorker): worker to map
+        submitted (float): time.perf_counter() when the map was submitted
+
+    Returns:
+        tuple[Any, WorkerStats]: result of the map step and its stats
+    """
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    input_data = worker.input_data
+    probe = InstrumentedInputData(input_data)
+    worker.input_data = probe
+    try:
+        worker.map()
+    finally:
+        worker.input_data = input_data
+    stats = WorkerStats(
+        name=str(getattr(input_data, "path", type(input_data).__name__)),
+        queue_wait=max(started - submitted, 0.0),
+        wall_time=time.perf_counter() - started,
+        cpu_time=time.thread_time() - cpu_started,
+        read_time=probe.read_time,
+        bytes_read=probe.bytes_read,
+    )
+    return worker.result, stats
+
+
+def run_reduce_timed(
+    left: GenericWorker, right: GenericWorker
+) -> tuple[GenericWorker, float]:
+    """Reduce right into left and measure it
+
+    Args:
+        left (GenericWorker): worker of the earlier inputs
+        right (GenericWorker): worker of the later inputs
+
+    Returns:
+        tuple[GenericWorker, float]: left holding the reduced result and the
+        elapsed seconds
+    """
+    start = time.perf_counter()
+    left.reduce(right)
+    return left, time.perf_counter() - start
+
+
+class JobStats:
+    """Per-phase and per-worker measurements of a MapReduce job
+
+    Pass an instance to execute() or mapreduce() to enable the measurement.
+    Phase totals are the sums of the time spent by each worker, so they may
+    exceed the elapsed time when maps run in parallel.
+    """
+
+    PHASES = ("listing", "reading", "mapping", "reducing")
+
+    def __init__(self) -> None:
+        self.elapsed = 0.0
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+        self.workers: list[WorkerStats] = []
+
+    def add_worker(self, stats: WorkerStats) -> None:
+        """Record the stats of a finished map
+
+        Args:
+            stats (WorkerStats): stats of the map
+        """
+        self.workers.append(stats)
+        self.phases["reading"] += stats.read_time
+        self.phases["mapping"] += stats.wall_time - stats.read_time
+
+    def timed_listing(
+        self, workers: Iterable[GenericWorker]
+    ) -> Iterator[GenericWorker]:
+        """Yield workers while measuring the time to list their inputs
+
+        Args:
+            workers (Iterable[GenericWorker]): workers to yield
+
+        Yields:
+            Iterator[GenericWorker]: the same workers
+        """
+        iterator = iter(workers)
+        while True:
+            start = time.perf_counter()
+            worker = next(iterator, None)
+            self.phases["listing"] += time.perf_counter() - start
+            if worker is None:
+                return
+            yield worker
+
+    def percentiles(
+        self, field: str = "wall_time", points: Iterable[int] = (50, 90, 99, 100)
+    ) -> dict[str, float]:
+        """Get nearest-rank percentiles of a field of the workers
+
+        Args:
+            field (str): field of WorkerStats
+            points (Iterable[int]): percentiles to compute
+
+        Returns:
+            dict[str, float]: e.g. {"p50": 0.1, "p90": 0.3, ...}
+        """
+        values = sorted(getattr(w, field) for w in self.workers)
+        if not values:
+            return {}
+        return {
+            f"p{point}": values[max(-(-point * len(values) // 100) - 1, 0)]
+            for point in points
+        }
+
+    def report(self, include_workers: bool = False) -> dict[str, Any]:
+        """Summarize the job
+
+        Args:
+            include_workers (bool): whether to include the stats of every map
+
+        Returns:
+            dict[str, Any]: elapsed time, phase totals and straggler
+            percentiles of wall time and queue wait
+        """
+        summary: dict[str, Any] = {
+            "elapsed": self.elapsed,
+            "phases": dict(self.phases),
+            "maps": len(self.workers),
+            "bytes_read": sum(w.bytes_read for w in self.workers),
+            "cpu_time": sum(w.cpu_time for w in self.workers),
+            "wall_time": self.percentiles("wall_time"),
+            "queue_wait": self.percentiles("queue_wait"),
+        }
+        if include_workers:
+            summary["workers"] = [w._asdict() for w in self.workers]
+        return summary
+
+    def to_json(self, include_workers: bool = False, **kwargs: Any) -> str:
+        """Serialize report() to JSON
+
+        Args:
+            include_workers (bool): whether to include the stats of every map
+            kwargs: keyword arguments of json.dumps()
+
+        Returns:
+            str: JSON of the report
+        """
+        return json.dumps(self.report(include_workers), **kwargs)
+
+
+def attempt_of(worker: GenericWorker) -> GenericWorker:
+    """Copy a worker for one attempt of its map
+
+    The result is deep-copied so that attempts which update it in place
+    don't share it. The tree keeps the original worker, which no attempt
+    maps.
+
+    Args:
+        worker (GenericWorker): worker to map
+
+    Returns:
+        GenericWorker: copy of the worker
+    """
+    attempt = copy.copy(worker)
+    attempt.result = copy.deepcopy(worker.result)
+    return attempt
+
+
+class TreeReduction:
+    """Pairwise tree reduction of workers on an executor
+
+    The i-th worker is a leaf (0, i) of a binary tree and node (level, index)
+    is reduced from (level - 1, 2 * index) and (level - 1, 2 * index + 1).
+    Siblings are reduced on the executor as soon as both are ready, so the
+    depth of the reduce step is log n and the order of reduce() calls does not
+    depend on which map finishes first.
+
+    With speculative=True, maps of idempotent workers which run much longer
+    than the median are duplicated in finish(), and the first copy to finish
+    wins. Every attempt then maps a copy of the worker (see attempt_of()),
+    so a losing attempt that is still running never touches a tree node.
+    """
+
+    def __init__(
+        self,
+        pool: Executor,
+        on_mapped: Optional[Callable[[GenericWorker], None]] = None,
+        stats: Optional[JobStats] = None,
+        speculative: bool = False,
+    ) -> None:
+        self.pool = pool
+        self.on_mapped = on_mapped
+        self.stats = stats
+        self.speculative = speculative
+        self.count = 0
+        self.maps = 0
+        self.nodes: dict[tuple[int, int], GenericWorker] = {}
+        self.in_flight: dict[Future, tuple[int, int, GenericWorker]] = {}
+        # 投機的実行のための記録. 中央値は直近のmapから求める
+        self.submitted_maps = 0
+        self.finished_maps = 0
+        self.submitted: dict[int, float] = {}
+        self.durations: deque[float] = deque(maxlen=1024)
+        self.copies: dict[int, list[Future]] = {}
+
+    def submit(self, worker: GenericWorker) -> None:
+        """Submit the map step of the next worker
+
+        Args:
+            worker (GenericWorker): worker to map
+        """
+        attempt = worker
+        if self.speculative:
+            self.submitted[self.count] = time.perf_counter()
+            if worker.idempotent:
+                attempt = attempt_of(worker)
+        self.in_flight[self.submit_map(attempt)] = (0, self.count, worker)
+        self.count += 1
+        self.maps += 1
+        self.submitted_maps += 1
+
+    def submit_map(self, worker: GenericWorker) -> Future:
+        """Submit run_map, or run_map_timed if stats are measured
+
+        Args:
+            worker (GenericWorker): worker to map
+
+        Returns:
+            Future: future of the map
+        """
+        if self.stats is None:
+            return self.pool.submit(run_map, worker)
+        return self.pool.submit(run_map_timed, worker, time.perf_counter())
+
+    def add(self, worker: GenericWorker) -> None:
+        """Add the next worker whose result is already known
+
+        Args:
+            worker (GenericWorker): worker holding its map result
+        """
+        self.place(0, self.count, worker)
+        self.count += 1
+
+    def place(self, level: int, index: int, worker: GenericWorker) -> None:
+        """Place a finished node and reduce it with its sibling if it is ready
+
+        Args:
+            level (int): level of the node. Leaves are 0.
+            index (int): index of the node in the level
+            worker (GenericWorker): worker holding the result of the node
+        """
+        sibling = self.nodes.pop((level, index ^ 1), None)
+        if sibling is None:
+            self.nodes[(level, index)] = worker
+            return
+        left, right = (worker, sibling) if index % 2 == 0 else (sibling, worker)
+        task: Callable[..., Any] = run_reduce
+        if self.stats is not None:
+            task = run_reduce_timed
+        parent = self.pool.submit(task, left, right)
+        self.in_flight[parent] = (level + 1, index // 2, left)
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait for at least one map or reduce to finish and reduce it with
+        its sibling if the sibling is ready
+
+        Args:
+            timeout (Optional[float]): maximum seconds to wait
+        """
+        done, _ = wait(self.in_flight, timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future not in self.in_flight:
+                # 先に終わった複製があり, 結果を捨てた
+                continue
+            level, index, worker = self.in_flight.pop(future)
+            result = future.result()
+            if level == 0:
+                self.maps -= 1
+                self.finished_maps += 1
+                # 残りの複製は取り消すか, 結果を無視する
+                for other in self.copies.pop(index, ()):
+                    if other is not future:
+                        other.cancel()
+                        self.in_flight.pop(other, None)
+                if self.speculative:
+                    elapsed = time.perf_counter() - self.submitted.pop(index)
+                    self.durations.append(elapsed)
+                if self.stats is not None:
+                    result, stats = result
+                    self.stats.add_worker(stats)
+                worker.result = result
+                if self.on_mapped is not None:
+                    self.on_mapped(worker)
+            elif self.stats is None:
+                worker = result
+            else:
+                worker, elapsed = result
+                self.stats.phases["reducing"] += elapsed
+            self.place(level, index, worker)
+
+    def finish(self) -> Optional[GenericWorker]:
+        """Wait for all tasks and reduce the remaining nodes in input order
+
+        Returns:
+            Optional[GenericWorker]: worker holding the reduced result, or
+            None if no worker was submitted
+        """
+        timeout = SPECULATION_INTERVAL if self.speculative else None
+        while self.in_flight:
+            self.wait(timeout)
+            if self.speculative:
+                self.speculate()
+        # 兄弟のいない部分木(高々log n個)を入力順に集計する
+        start = time.perf_counter()
+        total = None
+        for level, index in sorted(self.nodes, key=lambda n: n[1] << n[0]):
+            worker = self.nodes.pop((level, index))
+            if total is None:
+                total = worker
+            else:
+                total.reduce(worker)
+        if self.stats is not None:
+            self.stats.phases["reducing"] += time.perf_counter() - start
+        return total
+
+    def speculate(self) -> None:
+        """Duplicate running maps of idempotent workers that are stragglers
+
+        A map is a straggler when SPECULATION_QUANTILE of the submitted maps
+        have finished and it has been running for longer than
+        SPECULATION_FACTOR times the median time of the finished maps. Each
+        map is duplicated at most once.
+        """
+        if not self.durations:
+            return
+        if self.finished_maps < SPECULATION_QUANTILE * self.submitted_maps:
+            return
+        threshold = SPECULATION_FACTOR * statistics.median(self.durations)
+        now = time.perf_counter()
+        for future, (level, index, worker) in list(self.in_flight.items()):
+            if level != 0 or index in self.copies or not worker.idempotent:
+                continue
+            if not future.running() or now - self.submitted[index] <= threshold:
+                continue
+            duplicate = self.submit_map(attempt_of(worker))
+            self.in_flight[duplicate] = (level, index, worker)
+            self.copies[index] = [future, duplicate]
+
+
+class ResultCache:
+    """Map results persisted per input for incremental MapReduce
+
+    Results are stored with the cache_key() of their input, which changes
+    when the file is modified. Only entries used by the latest run are
+    saved, so results of deleted or modified inputs drop out of the total.
+    """
+
+    def __init__(self, path: str, worker_class: type[GenericWorker]) -> None:
+        self.path = path
+        self.tag = (
+            worker_class.__module__,
+            worker_class.__qualname__,
+            worker_class.version,
+        )
+        self.entries: dict[Hashable, bytes] = {}
+        self.used: dict[Hashable, bytes] = {}
+        try:
+            with open(path, "rb") as f:
+                tag, entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return
+        # ワーカークラスやバージョンが違う結果は使わない
+        if tag == self.tag:
+            self.entries = entries
+
+    def lookup(self, worker: GenericWorker) -> bool:
+        """Set the cached result of worker's input to worker.result
+
+        Args:
+            worker (GenericWorker): worker to look up
+
+        Returns:
+            bool: True if the result was cached
+        """
+        key = worker.input_data.cache_key()
+        if key is None or key not in self.entries:
+            return False
+        self.used[key] = self.entries[key]
+        worker.result = pickle.loads(self.used[key])
+        return True
+
+    def store(self, worker: GenericWorker) -> None:
+        """Store the map result of worker
+
+        Args:
+            worker (GenericWorker): worker whose map step has finished
+        """
+        key = worker.input_data.cache_key()
+        if key is not None:
+            self.used[key] = pickle.dumps(worker.result, pickle.HIGHEST_PROTOCOL)
+
+    def save(self) -> None:
+        """Write the entries used by the latest run to self.path"""
+        # 書き込み途中で中断しても壊れないよう一時ファイルから置き換える
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((self.tag, self.used), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.entries, self.used = self.used, {}
+
+
+def execute(
+    workers: Iterable[GenericWorker],
+    executor: Union[str, Executor] = "thread",
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    cache: Optional[ResultCache] = None,
+    stats: Optional[JobStats] = None,
+    speculative: bool = False,
+) -> Any:
+    """Execute MapReduce model
+
+    Workers are pulled lazily from workers and at most max_in_flight maps
+    run at once. Finished results are reduced pairwise on the same executor
+    (see TreeReduction), so memory use does not depend on the number of
+    inputs and the result is deterministic for associative reducers.
+
+    Args:
+        workers (Iterable[GenericWorker]): Workers to execute
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance used for the map and reduce steps
+        max_workers (Optional[int]): Maximum number of workers of the pool
+        max_in_flight (Optional[int]): Maximum number of maps submitted at
+        once. Defaults to twice max_workers or the number of CPUs.
+        cache (Optional[ResultCache]): cache of map results. Cached inputs
+        skip the map step and new results are stored into it.
+        stats (Optional[JobStats]): filled with the measurements of the job
+        if given. Nothing is measured when it is None.
+        speculative (bool): whether to duplicate straggling maps of workers
+        declaring idempotent = True. The losing copies are not waited for.
+
+    Returns:
+        Any: Reduced result of the workers such as total count of lines in
+        files, or None if there are no workers
+    """
+    started = time.perf_counter()
+    if max_in_flight is None:
+        max_in_flight = 2 * (max_workers or os.cpu_count() or 1)
+    # 渡されたExecutorインスタンスは呼び出し側が管理するためshutdownしない
+    pool = create_executor(executor, max_workers)
+    on_mapped = None if cache is None else cache.store
+    reduction = TreeReduction(pool, on_mapped, stats, speculative)
+    if stats is not None:
+        workers = stats.timed_listing(workers)
+    try:
+        # Map step
+        # 実行中のmapがmax_in_flightに達したら終わるまで次の入力を取り出さない
+        for worker in workers:
+            if cache is not None and cache.lookup(worker):
+                reduction.add(worker)
+                continue
+            while reduction.maps >= max_in_flight:
+                # Reduce step
+                # 隣り合う結果が揃ったものからツリー状に集計する
+                reduction.wait()
+            reduction.submit(worker)
+        total = reduction.finish()
+    finally:
+        if pool is not executor:
+            # 投機的実行で負けたmapの終了は待たない
+            pool.shutdown(wait=not speculative, cancel_futures=True)
+    if stats is not None:
+        stats.elapsed += time.perf_counter() - started
+    return None if total is None else total.result
+
+
+def mapreduce(
+    worker_class: type[GenericWorker],
+    input_class: type[GenericInputData],
+    config: dict[str, str],
+    executor: Union[str, Executor] = "thread",
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    stats: Optional[JobStats] = None,
+) -> Optional[int]:
+    """Execute the MapReduce process using the provided worker class, input
+    class, and configuration.
+
+    Args:
+        worker_class (type[GenericWorker]): The worker class responsible for
+        processing input data.
+        input_class (type[GenericInputData]): The input data class to be used for
+        generating inputs.
+        config (dict[str, str]): Configuration containing data directory path,
+        and optionally "cache_path" to reuse map results of unchanged inputs
+        and "speculative" ("true" to duplicate straggling maps).
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance used for the map step.
+        max_workers (Optional[int]): Maximum number of workers of the pool.
+        max_in_flight (Optional[int]): Maximum number of maps submitted at
+        once.
+        stats (Optional[JobStats]): filled with per-phase and per-worker
+        measurements of the job if given.
+
+    Returns:
+        Optional[int]: The total count of lines in the files processed by the
+        MapReduce process, or None if the process fails.
+
+    Raises:
+        NotImplementedError: If the worker class or input class does not
+        support the required methods.
+        TypeError: If input_class is AsyncInputData.
+    """
+    check_sync_input(input_class)
+    workers = worker_class.generate_workers(input_class, config)
+    speculative = config_flag(config, "speculative")
+    # 前回から変わっていない入力はmapを省略する
+    cache = None
+    if "cache_path" in config:
+        cache = ResultCache(config["cache_path"], worker_class)
+    result = execute(
+        workers, executor, max_workers, max_in_flight, cache, stats, speculative
+    )
+    if cache is not None:
+        cache.save()
+    return result
+
+
+def mapreduce_keyed(
+    worker_class: type[KeyValueWorker],
+    input_class: type[GenericInputData],
+    config: dict[str, str],
+    executor: Union[str, Executor] = "thread",
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+) -> list[str]:
+    """Execute the MapReduce process with a keyed shuffle stage.
+
+    Maps spill sorted run files per partition, then one reducer per
+    partition k-way merges them on the same executor. The data may be
+    larger than memory because only run file paths are kept in memory.
+
+    Args:
+        worker_class (type[KeyValueWorker]): The worker class emitting key/value
+        pairs.
+        input_class (type[GenericInputData]): The input data class to be used for
+        generating inputs.
+        config (dict[str, str]): Configuration containing data directory path,
+        and optionally "spill_dir", "partitions" and "max_keys".
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance.
+        max_workers (Optional[int]): Maximum number of workers of the pool.
+        max_in_flight (Optional[int]): Maximum number of maps submitted at
+        once.
+
+    Returns:
+        list[str]: Paths of the sorted output of each partition. Use
+        read_pairs() to read them.
+    """
+    check_sync_input(input_class)
+    config = dict(config)
+    if "spill_dir" not in config:
+        config["spill_dir"] = tempfile.mkdtemp(prefix="mapreduce-")
+    spill_dir = config["spill_dir"]
+    partitions = int(config.get("partitions", worker_class.partitions))
+    pool = create_executor(executor, max_workers)
+    try:
+        workers = worker_class.generate_workers(input_class, config)
+        runs = execute(workers, pool, max_workers, max_in_flight)
+        if runs is None:
+            runs = [[] for _ in range(partitions)]
+        # Shuffle step : パーティションごとに1つのreducerを割り当てる
+        futures = [
+            pool.submit(
+                merge_partition,
+                worker_class,
+                partition_runs,
+                os.path.join(spill_dir, f"part-{i:05d}"),
+            )
+            for i, partition_runs in enumerate(runs)
+        ]
+        return [future.result() for future in futures]
+    finally:
+        if pool is not executor:
+            pool.shutdown(cancel_futures=True)
+
+
+async def execute_async(
+    workers: Iterable[GenericWorker],
+    executor: Union[str, Executor] = "thread",
+    max_workers: Optional[int] = None,
+    max_concurrency: int = 64,
+) -> Any:
+    """Execute MapReduce model on asyncio for I/O-bound inputs
+
+    AsyncInputData is read on the event loop and the map step runs on
+    executor. At most max_concurrency inputs are read or mapped at once, and
+    workers are pulled from workers only when a slot is free. Results are
+    reduced in the same tree as execute(). Note that with a process pool
+    the content read on the event loop is sent to the worker process.
+
+    Args:
+        workers (Iterable[GenericWorker]): Workers to execute
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance used for the map step
+        max_workers (Optional[int]): Maximum number of workers of the pool
+        max_concurrency (int): Maximum number of inputs processed at once
+
+    Returns:
+        Any: Reduced result of the workers, or None if there are no workers
+    """
+    loop = asyncio.get_running_loop()
+    pool = create_executor(executor, max_workers)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # reduceはイベントループ上で入力順のツリーとして行う
+    reduction = TreeReduction(SerialExecutor())
+
+    async def run(index: int, worker: GenericWorker) -> None:
+        try:
+            if isinstance(worker.input_data, AsyncInputData):
+                data = await worker.input_data.read()
+                worker.input_data = LoadedInputData(data)
+            # CPUを使うmapはイベントループを止めないようexecutorに渡す
+            worker.result = await loop.run_in_executor(pool, run_map, worker)
+            reduction.place(0, index, worker)
+            while reduction.in_flight:
+                reduction.wait()
+        finally:
+            semaphore.release()
+
+    tasks: set[asyncio.Task] = set()
+    errors: list[BaseException] = []
+
+    def done(task: asyncio.Task) -> None:
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            errors.append(task.exception())  # type: ignore[arg-type]
+
+    try:
+        for index, worker in enumerate(workers):
+            await semaphore.acquire()
+            if errors:
+                break
+            task = asyncio.create_task(run(index, worker))
+            tasks.add(task)
+            task.add_done_callback(done)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if errors:
+            raise errors[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+        if pool is not executor:
+            pool.shutdown(cancel_futures=True)
+    total = reduction.finish()
+    return None if total is None else total.result
+
+
+async def mapreduce_async(
+    worker_class: type[GenericWorker],
+    input_class: type[GenericInputData],
+    config: dict[str, str],
+    executor: Union[str, Executor] = "thread",
+    max_workers: Optional[int] = None,
+    max_concurrency: int = 64,
+) -> Any:
+    """Execute the MapReduce process on asyncio.
+
+    Args:
+        worker_class (type[GenericWorker]): The worker class responsible for
+        processing input data.
+        input_class (type[GenericInputData]): The input data class to be used for
+        generating inputs, typically a subclass of AsyncInputData.
+        config (dict[str, str]): Configuration of input_class.
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance used for the map step.
+        max_workers (Optional[int]): Maximum number of workers of the pool.
+        max_concurrency (int): Maximum number of inputs processed at once.
+
+    Returns:
+        Any: Reduced result of the workers, or None if there are no workers.
+    """
+    workers = worker_class.generate_workers(input_class, config)
+    return await execute_async(workers, executor, max_workers, max_concurrency)
+
+
+# マネージャーのサーバープロセスが保持するキュー
+cluster_tasks: queue.Queue = queue.Queue()
+cluster_results: queue.Queue = queue.Queue()
+
+
+def get_cluster_tasks() -> queue.Queue:
+    """Get the task queue in the manager process"""
+    return cluster_tasks
+
+
+def get_cluster_results() -> queue.Queue:
+    """Get the result queue in the manager process"""
+    return cluster_results
+
+
+class ClusterManager(BaseManager):
+    """Manager sharing the task and result queues of a cluster over TCP"""
+
+
+ClusterManager.register("get_tasks", callable=get_cluster_tasks)
+ClusterManager.register("get_results", callable=get_cluster_results)
+
+
+def run_node(address: tuple[str, int], authkey: bytes) -> None:
+    """Run maps pulled from the coordinator until it shuts down
+
+    Each task is (task_id, worker). The node reports ("started", task_id,
+    node) before the map and ("done", task_id, result) or ("error", task_id,
+    traceback) after it. A thread reports ("alive", task_id, node) every
+    CLUSTER_HEARTBEAT_INTERVAL seconds, with the running task_id or None.
+
+    Args:
+        address (tuple[str, int]): address of the coordinator
+        authkey (bytes): authentication key of the coordinator
+    """
+    manager = ClusterManager(address, authkey)
+    manager.connect()
+    tasks, results = manager.get_tasks(), manager.get_results()  # type: ignore
+    node = f"{socket.gethostname()}:{os.getpid()}"
+    running: list[Optional[int]] = [None]
+    stopped = threading.Event()
+
+    def heartbeat() -> None:
+        # プロキシはスレッドごとに接続を持つので, mapの実行中も送れる
+        while not stopped.wait(CLUSTER_HEARTBEAT_INTERVAL):
+            try:
+                results.put(("alive", running[0], node))
+            except (EOFError, OSError):
+                return
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        while True:
+            try:
+                task_id, worker = tasks.get(timeout=CLUSTER_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            running[0] = task_id
+            results.put(("started", task_id, node))
+            try:
+                message = ("done", task_id, run_map(worker))
+            except Exception:
+                message = ("error", task_id, traceback.format_exc())
+            results.put(message)
+            running[0] = None
+    except (EOFError, OSError):
+        # コーディネーターが終了した
+        return
+    finally:
+        stopped.set()
+
+
+def mapreduce_cluster(
+    worker_class: type[GenericWorker],
+    input_class: type[GenericInputData],
+    config: dict[str, str],
+    address: tuple[str, int] = ("127.0.0.1", 0),
+    authkey: Optional[bytes] = None,
+    local_nodes: int = 0,
+    max_in_flight: int = 1024,
+    node_timeout: float = 10.0,
+    queue_timeout: float = 300.0,
+    max_attempts: int = 3,
+) -> Any:
+    """Execute the MapReduce process on nodes connected over TCP.
+
+    The coordinator serves a task queue and a result queue with
+    multiprocessing.managers. Nodes run run_node() with the same address and
+    authkey, e.g. on other machines. A node which sends no heartbeat for
+    node_timeout seconds is considered lost and its task is queued again, so
+    a lost node only delays the job however long the maps run. If no task is
+    queued, finished or running for queue_timeout seconds, the tasks not
+    started yet are queued again as well. Tasks are queued again only for
+    idempotent workers and at most max_attempts times in total.
+
+    Args:
+        worker_class (type[GenericWorker]): The worker class responsible for
+        processing input data.
+        input_class (type[GenericInputData]): The input data class to be used for
+        generating inputs. Its instances are sent to the nodes.
+        config (dict[str, str]): Configuration of input_class.
+        address (tuple[str, int]): address to listen on. Port 0 picks a free
+        port.
+        authkey (Optional[bytes]): authentication key. Defaults to the key of
+        the current process.
+        local_nodes (int): number of node processes to start on this machine.
+        max_in_flight (int): Maximum number of tasks queued or running.
+        node_timeout (float): seconds without a heartbeat after which the task
+        of a node is requeued.
+        queue_timeout (float): seconds without new, finished or running tasks
+        after which the tasks not started yet are requeued.
+        max_attempts (int): maximum number of times a task is queued.
+
+    Returns:
+        Any: Reduced result of the workers, or None if there are no workers.
+
+    Raises:
+        RuntimeError: If a map raises an exception on a node.
+        TimeoutError: If a task would be queued again although worker_class
+        is not idempotent or it was already queued max_attempts times, e.g.
+        because no node is alive.
+        TypeError: If input_class is AsyncInputData.
+    """
+    check_sync_input(input_class)
+    if authkey is None:
+        authkey = bytes(multiprocessing.current_process().authkey)
+    manager = ClusterManager(address, authkey)
+    manager.start()
+    nodes = [
+        multiprocessing.Process(target=run_node, args=(manager.address, authkey))
+        for _ in range(local_nodes)
+    ]
+    for node in nodes:
+        node.start()
+    tasks, results = manager.get_tasks(), manager.get_results()  # type: ignore
+    # reduceはコーディネーター上で入力順のツリーとして行う
+    reduction = TreeReduction(SerialExecutor())
+    # task_id -> (worker, 実行中のノード, 投入回数). 開始前のノードはNone
+    pending: dict[int, tuple[GenericWorker, Optional[str], int]] = {}
+    # ノード -> 最後に報告を受けた時刻
+    last_seen: dict[str, float] = {}
+    last_progress = time.monotonic()
+
+    def requeue(task_id: int, reason: str) -> None:
+        worker, _, attempts = pending[task_id]
+        if not worker_class.idempotent or attempts >= max_attempts:
+            raise TimeoutError(f"Task {task_id} {reason} after {attempts} attempts")
+        pending[task_id] = (worker, None, attempts + 1)
+        tasks.put((task_id, worker))
+
+    def receive() -> None:
+        nonlocal last_progress
+        try:
+            message = results.get(timeout=CLUSTER_POLL_INTERVAL)
+        except queue.Empty:
+            message = None
+        now = time.monotonic()
+        if message is not None:
+            kind, task_id, payload = message
+            # 暇なノードの生存通知だけでは, キューのタスクが進んでいるとはいえない
+            if kind != "alive" or task_id is not None:
+                last_progress = now
+            if kind in ("alive", "started"):
+                last_seen[payload] = now
+            if kind != "alive" and task_id in pending:
+                worker, _, attempts = pending[task_id]
+                if kind == "started":
+                    pending[task_id] = (worker, payload, attempts)
+                elif kind == "error":
+                    raise RuntimeError(f"Map of task {task_id} failed:\n{payload}")
+                else:
+                    # 再実行されたタスクの2つ目以降の結果は無視される
+                    del pending[task_id]
+                    worker.result = payload
+                    reduction.place(0, task_id, worker)
+                    while reduction.in_flight:
+                        reduction.wait()
+        # 生存通知が途絶えたノードのタスクは, ノードが失われたとみなして再投入する
+        for task_id, (_, node, _) in list(pending.items()):
+            if node is not None and now - last_seen[node] > node_timeout:
+                requeue(task_id, f"lost node {node}")
+        # 投入も報告もなければ, 取り出した直後に落ちたノードがあるか生きたノードがない
+        if now - last_progress > queue_timeout:
+            last_progress = now
+            for task_id, (_, node, _) in list(pending.items()):
+                if node is None:
+                    requeue(task_id, "was not started")
+
+    try:
+        for task_id, worker in enumerate(
+            worker_class.generate_workers(input_class, config)
+        ):
+            while len(pending) >= max_in_flight:
+                receive()
+            pending[task_id] = (worker, None, 1)
+            tasks.put((task_id, worker))
+            last_progress = time.monotonic()
+        while pending:
+            receive()
+    finally:
+        manager.shutdown()
+        for node in nodes:
+            node.join(timeout=5)
+            if node.is_alive():
+                node.terminate()
+    total = reduction.finish()
+    return None if total is None else total.result
+
+
+def int64_table(shm: SharedMemory) -> memoryview:
+    """View the buffer of a SharedMemory as an array of int64
+
+    Args:
+        shm (SharedMemory): attached shared memory
+
+    Returns:
+        memoryview: view of the buffer cast to "q"
+    """
+    if shm.buf is None:
+        raise ValueError(f"shared memory {shm.name} is closed")
+    return shm.buf.cast("q")
+
+
+def run_map_shared(worker: GenericWorker, name: str, slot: int, width: int) -> None:
+    """Run the map step of worker and add its result into a shared array
+
+    Only the slot crosses the process boundary, not the result.
+
+    Args:
+        worker (GenericWorker): worker whose result is an int or `width` ints
+        name (str): name of the SharedMemory
+        slot (int): row of the array used only by this map
+        width (int): number of int64 values in a row
+    """
+    worker.map()
+    values = worker.result if width > 1 else [worker.result]
+    shm = SharedMemory(name)
+    table = int64_table(shm)
+    try:
+        offset = slot * width
+        for k, value in enumerate(values):
+            table[offset + k] += value
+    finally:
+        table.release()
+        shm.close()
+
+
+def mapreduce_shared(
+    worker_class: type[GenericWorker],
+    input_class: type[GenericInputData],
+    config: dict[str, str],
+    executor: Union[str, Executor] = "process",
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+) -> list[int]:
+    """Execute the MapReduce process aggregating results in shared memory.
+
+    Results must be fixed-width integers: an int, or a list of
+    worker_class.width ints. A SharedMemory array with one row per map in
+    flight is allocated. Each map adds its result into a free row, and the
+    rows are summed into the first row in place at the end, so results are
+    never pickled. Use this when results are large and their reduce is an
+    element-wise sum, e.g. histograms.
+
+    Args:
+        worker_class (type[GenericWorker]): The worker class responsible for
+        processing input data.
+        input_class (type[GenericInputData]): The input data class to be used for
+        generating inputs.
+        config (dict[str, str]): Configuration of input_class.
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance used for the map step.
+        max_workers (Optional[int]): Maximum number of workers of the pool.
+        max_in_flight (Optional[int]): Maximum number of maps submitted at
+        once, i.e. the number of rows of the array.
+
+    Returns:
+        list[int]: element-wise sum of the results
+    """
+    check_sync_input(input_class)
+    width = getattr(worker_class, "width", 1)
+    if max_in_flight is None:
+        max_in_flight = 2 * (max_workers or os.cpu_count() or 1)
+    shm = SharedMemory(create=True, size=max_in_flight * width * 8)
+    table = int64_table(shm)
+    pool = create_executor(executor, max_workers)
+    try:
+        for i in range(len(table)):
+            table[i] = 0
+        free = list(range(max_in_flight))
+        in_flight: dict[Future, int] = {}
+
+        def release_finished() -> None:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+                free.append(in_flight.pop(future))
+
+        # Map step
+        # 空いている行を割り当て, 結果はその行に加算される
+        for worker in worker_class.generate_workers(input_class, config):
+            if not free:
+                release_finished()
+            slot = free.pop()
+            in_flight[pool.submit(run_map_shared, worker, shm.name, slot, width)] = slot
+        while in_flight:
+            release_finished()
+
+        # Reduce step
+        # 共有メモリ上でコピーせずに1行目へ集計する
+        for offset in range(width, len(table)):
+            table[offset % width] += table[offset]
+        return table[:width].tolist()
+    finally:
+        if pool is not executor:
+            pool.shutdown(cancel_futures=True)
+        table.release()
+        shm.close()
+        shm.unlink()
+
+
+def benchmark_executors(
+    config: dict[str, str],
+    executors: Iterable[str] = ("serial", "thread", "process"),
+    core_counts: Optional[Iterable[int]] = None,
+) -> dict[tuple[str, int], float]:
+    """Measure the elapsed time of mapreduce for each executor and core count
+
+    Args:
+        config (dict[str, str]): Configuration containing data directory path
+        executors (Iterable[str]): names of executor to measure
+        core_counts (Optional[Iterable[int]]): numbers of workers to measure.
+        Defaults to powers of two up to os.cpu_count().
+
+    Returns:
+        dict[tuple[str, int], float]: elapsed seconds keyed by
+        (executor, max_workers)
+    """
+    if core_counts is None:
+        cpu_count = os.cpu_count() or 1
+        core_counts = [2**i for i in range(cpu_count.bit_length())]
+    timings = {}
+    for name in executors:
+        # serialは並列度に依存しないため1回だけ測る
+        counts = [1] if name == "serial" else core_counts
+        for max_workers in counts:
+            start = time.perf_counter()
+            mapreduce(LineCountWorker, PathInputData, config, name, max_workers)
+            timings[(name, max_workers)] = time.perf_counter() - start
+    return timings
+
+
+def dataset_line_counts(
+    file_count: int, total_lines: int, distribution: str = "uniform", seed: int = 0
+) -> list[int]:
+    """Decide the number of lines of each file of a synthetic dataset
+
+    Args:
+        file_count (int): number of files
+        total_lines (int): sum of the lines of all files
+        distribution (str): "uniform" (same size), "zipf" (the k-th largest
+        file is proportional to 1 / k) or "giant" (one file has 90% of lines)
+        seed (int): seed deciding which file gets which size
+
+    Returns:
+        list[int]: number of lines of each file
+
+    Raises:
+        ValueError: If the distribution is unknown.
+    """
+    if distribution == "uniform":
+        weights = [1.0] * file_count
+    elif distribution == "zipf":
+        weights = [1 / rank for rank in range(1, file_count + 1)]
+    elif distribution == "giant":
+        # ファイルが0個なら空, 1個ならそのファイルが全行を持つ
+        weights = [9.0 * (file_count - 1) or 1.0] if file_count else []
+        weights += [1.0] * (file_count - 1)
+    else:
+        raise ValueError(f"Unknown distribution: {distribution!r}")
+    # 大きいファイルの位置をseedで決める
+    random.Random(seed).shuffle(weights)
+    total_weight = sum(weights)
+    counts = [int(total_lines * w / total_weight) for w in weights]
+    # 端数は重みの大きいファイルに足して合計をtotal_linesに合わせる
+    largest = max(range(file_count), key=weights.__getitem__, default=0)
+    if counts:
+        counts[largest] += total_lines - sum(counts)
+    return counts
+
+
+def dataset_path(index: int, depth: int, fanout: int) -> str:
+    """Get the relative path of the index-th file of a synthetic dataset
+
+    Args:
+        index (int): index of the file
+        depth (int): number of nested directories
+        fanout (int): number of subdirectories of each directory
+
+    Returns:
+        str: e.g. "d0/d1/7" for index 7, depth 2 and fanout 4
+    """
+    dirs = [f"d{index // fanout**level % fanout}" for level in range(depth, 0, -1)]
+    return os.path.join(*dirs, str(index))
+
+
+def write_dataset_file(path: str, lines: int, seed: int) -> int:
+    """Write a file of random words with a seeded generator
+
+    Args:
+        path (str): file path
+        lines (int): number of lines to write
+        seed (int): seed of the content
+
+    Returns:
+        int: number of bytes written
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for start in range(0, lines, 1024):
+            block = [
+                " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+                for _ in range(min(1024, lines - start))
+            ]
+            f.write("\n".join(block) + "\n")
+        return f.tell()
+
+
+def write_dataset(
+    data_dir: str,
+    file_count: int = 100,
+    total_lines: int = 100_000,
+    distribution: str = "uniform",
+    depth: int = 0,
+    fanout: int = 4,
+    seed: int = 0,
+    executor: Union[str, Executor] = "process",
+    max_workers: Optional[int] = None,
+) -> int:
+    """Generate a deterministic synthetic dataset for MapReduce benchmarks
+
+    Each file is written by its own task on executor with a seed derived from
+    seed and its index, so the content does not depend on the executor.
+
+    Args:
+        data_dir (str): dir path
+        file_count (int): number of files
+        total_lines (int): sum of the lines of all files
+        distribution (str): "uniform", "zipf" or "giant". See
+        dataset_line_counts().
+        depth (int): number of nested directories
+        fanout (int): number of subdirectories of each directory
+        seed (int): seed of the dataset
+        executor (Union[str, Executor]): "serial", "thread", "process" or an
+        Executor instance used to write files
+        max_workers (Optional[int]): Maximum number of workers of the pool
+
+    Returns:
+        int: total number of lines, i.e. the expected LineCountWorker result
+    """
+    counts = dataset_line_counts(file_count, total_lines, distribution, seed)
+    pool = create_executor(executor, max_workers)
+    try:
+        futures = [
+            pool.submit(
+                write_dataset_file,
+                os.path.join(data_dir, dataset_path(i, depth, fanout)),
+                lines,
+                seed * 1_000_003 + i,
+            )
+            for i, lines in enumerate(counts)
+        ]
+        for future in futures:
+            future.result()
+    finally:
+        if pool is not executor:
+            pool.shutdown()
+    return sum(counts)
+
+
+def run_benchmark(
+    config: dict[str, str],
+    executors: Iterable[str] = ("serial", "thread", "process"),
+    input_classes: Iterable[type[GenericInputData]] = (
+        PathInputData,
+        ShardedPathInputData,
+    ),
+    max_workers: Optional[int] = None,
+    repeat: int = 3,
+    output_path: Optional[str] = None,
+) -> dict[str, Any]:
+    """Time mapreduce with LineCountWorker for each executor and input class
+
+    Args:
+        config (dict[str, str]): Configuration of the input classes
+        executors (Iterable[str]): names of executor to measure
+        input_classes (Iterable[type[GenericInputData]]): input modes to measure
+        max_workers (Optional[int]): Maximum number of workers of the pool
+        repeat (int): number of runs of each case
+        output_path (Optional[str]): path to write the results as JSON
+
+    Returns:
+        dict[str, Any]: environment and the best and median seconds, result
+        and throughput of each case
+    """
+    cases = []
+    for input_class in input_classes:
+        for name in executors:
+            timings = []
+            for _ in range(repeat):
+                stats = JobStats()
+                result = mapreduce(
+                    LineCountWorker, input_class, config, name, max_workers, stats=stats
+                )
+                timings.append(stats.elapsed)
+            best = min(timings)
+            bytes_read = sum(w.bytes_read for w in stats.workers)
+            cases.append(
+                {
+                    "case": f"{input_class.__name__}/{name}",
+                    "best": best,
+                    "median": statistics.median(timings),
+                    "result": result,
+                    "bytes_per_second": bytes_read / best if best else 0.0,
+                }
+            )
+    results = {
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "max_workers": max_workers,
+        "repeat": repeat,
+        "cases": cases,
+    }
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def compare_benchmarks(baseline_path: str, current_path: str) -> dict[str, float]:
+    """Compare two results written by run_benchmark()
+
+    Args:
+        baseline_path (str): path of the baseline results
+        current_path (str): path of the current results
+
+    Returns:
+        dict[str, float]: ratio of the current best time to the baseline for
+        each case measured in both. Values above 1 are regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = {case["case"]: case["best"] for case in json.load(f)["cases"]}
+    with open(current_path) as f:
+        current = {case["case"]: case["best"] for case in json.load(f)["cases"]}
+    return {
+        case: current[case] / baseline[case]
+        for case in current
+        if case in baseline and baseline[case] > 0
+    }
+
+
+def compress_dataset(data_dir: str, output_dir: str, codec: str = "gzip") -> None:
+    """Write a compressed copy of each file under data_dir
+
+    Args:
+        data_dir (str): dir path of the files to compress
+        output_dir (str): dir path of the compressed copies
+        codec (str): key of CODECS
+    """
+    opener, extension, _ = CODECS[codec]
+    for entry in scan_files(data_dir, recursive=True):
+        relpath = os.path.relpath(entry.path, data_dir)
+        path = os.path.join(output_dir, relpath + extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(entry.path, "rb") as src, opener(path, "wb") as dst:
+            while chunk := src.read(CHUNK_SIZE):
+                dst.write(chunk)
+
+
+def write_test_files(tmpdir: str, file_count: int = 100, max_lines: int = 100) -> None:
+    """Generate sample file for test MapReduce
 
     Args:
         tmpdir (str): dir path
+        file_count (int): number of files to write
+        max_lines (int): maximum number of lines in each file
     """
     os.makedirs(tmpdir, exist_ok=True)
-    for i in range(100):
+    for i in range(file_count):
         with open(os.path.join(tmpdir, str(i)), "w") as f:
-            f.write("\n" * random.randint(0, 100))
+            f.write("\n" * random.randint(0, max_lines))
 
 
 if __name__ == "__main__":
@@ -230,3 +2428,33 @@ if __name__ == "__main__":
     config = {"data_dir": tmpdir}
     result = mapreduce(LineCountWorker, PathInputData, config)
     print(f"There are {result} lines")
+
+    # GILがあるためスレッドではmap()は1コアでしか動かない
+    # ProcessPoolExecutorを使うとコア数に応じてスケールする
+    for name in ("serial", "thread", "process"):
+        result = mapreduce(LineCountWorker, PathInputData, config, name)
+        print(f"{name:>7}: There are {result} lines")
+
+    bench_dir = "bench_inputs"
+    write_dataset(bench_dir, file_count=64, total_lines=2_000_000, distribution="zipf")
+    bench_config = {"data_dir": bench_dir, "recursive": "true"}
+    timings = benchmark_executors(bench_config)
+    for (name, max_workers), elapsed in timings.items():
+        print(f"{name:>7} x {max_workers:>2}: {elapsed:.3f}s")
+
+    # 実行方式と入力クラスの組み合わせごとの結果をJSONで保存し, 前回と比較する
+    results = run_benchmark(bench_config, output_path="bench_results.json")
+    for case in results["cases"]:
+        print(f"{case['case']:>28}: {case['best']:.3f}s")
+
+    # 圧縮したファイルはmapの中で展開するので, プロセスプールで並列に展開される
+    compressed_dir = "bench_inputs_gz"
+    compress_dataset(bench_dir, compressed_dir)
+    for input_class, data_dir in [
+        (PathInputData, bench_dir),
+        (CompressedPathInputData, compressed_dir),
+    ]:
+        config = {"data_dir": data_dir, "recursive": "true"}
+        results = run_benchmark(config, ["process"], [input_class], repeat=1)
+        case = results["cases"][0]
+        print(f"{case['case']:>28}: {case['bytes_per_second'] / 1e6:.1f}MB/s")
@@ -0,0 +1,257 @@
+import csv
+import json
+import math
+import random
+import statistics
+import threading
+
+import pytest
+
+from src import create_class
+from src.create_class import (GRADE_FIELDS, ColumnarGradebook,
+                              CompactGradebook, ConcurrentGradebook, Gradebook,
+                              IndexedGradebook, QuantileSketch, RankTree,
+                              SketchedGradebook)
+from src.function_return_unpack import get_stats
+
+GRADES = [
+    ("Albert Einstein", "Math", 75, 0.05),
+    ("Albert Einstein", "Math", 65, 0.15),
+    ("Albert Einstein", "Gym", 100, 0.40),
+    ("Isaac Newton", "Math", 90, 0.5),
+    ("Albert Einstein", "Math", 70, 0.80),
+    ("Albert Einstein", "Gym", 85, 0.60),
+    ("Isaac Newton", "Gym", 60, 1.0),
+]
+
+
+def fill(book):
+    for name, subject, score, weight in GRADES:
+        book.get_student(name).get_subject(subject).report_grade(score, weight)
+    return book
+
+
+@pytest.mark.parametrize("book_class", [CompactGradebook, ColumnarGradebook])
+def test_gradebook_averages(book_class):
+    expected = fill(Gradebook())
+    book = fill(book_class())
+    for name in ["Albert Einstein", "Isaac Newton"]:
+        student = book.get_student(name)
+        expected_student = expected.get_student(name)
+        assert student.average_grade() == expected_student.average_grade()
+        for subject in ["Math", "Gym"]:
+            assert (
+                student.get_subject(subject).average_grade()
+                == expected_student.get_subject(subject).average_grade()
+            )
+
+
+@pytest.mark.parametrize(
+    "book_class", [Gradebook, CompactGradebook, ColumnarGradebook]
+)
+def test_running_averages_match_recompute(book_class):
+    book = book_class()
+    for name, subject_name, score, weight in GRADES:
+        student = book.get_student(name)
+        subject = student.get_subject(subject_name)
+        subject.report_grade(score, weight)
+        assert subject.average_grade() == subject.recompute_average_grade()
+        # 記録のたびに学生の平均のキャッシュも無効になる
+        assert student.average_grade() == student.recompute_average_grade()
+
+
+@pytest.mark.parametrize(
+    "book_class", [Gradebook, CompactGradebook, ColumnarGradebook]
+)
+@pytest.mark.parametrize("suffix", [".csv", ".ndjson", None])
+def test_bulk_load(tmp_path, book_class, suffix):
+    if suffix == ".csv":
+        source = tmp_path / "grades.csv"
+        with open(source, "w", newline="") as f:
+            csv.writer(f).writerows([GRADE_FIELDS, *GRADES])
+    elif suffix == ".ndjson":
+        source = tmp_path / "grades.ndjson"
+        source.write_text(
+            "".join(json.dumps(dict(zip(GRADE_FIELDS, row))) + "\n" for row in GRADES)
+        )
+    else:
+        source = iter(GRADES)
+    expected = fill(book_class())
+    book = book_class()
+    # バッチをまたいでも1行ずつ記録した場合と同じ平均になる
+    report = book.bulk_load(source, batch_size=3)
+    assert report.rows == len(GRADES)
+    for name in ["Albert Einstein", "Isaac Newton"]:
+        student = book.get_student(name)
+        expected_student = expected.get_student(name)
+        assert student.average_grade() == expected_student.average_grade()
+        assert student.recompute_average_grade() == student.average_grade()
+
+
+def test_ranking_index():
+    rng = random.Random(0)
+    book = IndexedGradebook()
+    names = [f"student{i}" for i in range(50)]
+    for _ in range(500):
+        name = rng.choice(names)
+        subject = rng.choice(["Math", "Gym"])
+        book.get_student(name).get_subject(subject).report_grade(
+            rng.randrange(101), rng.choice([0.5, 1.0])
+        )
+        # 点数が記録されるたびに索引が更新され, 走査した結果と一致する
+        averages = sorted(
+            (-book.get_student(student).get_subject(subject).average_grade(), student)
+            for student in book.students_of(subject)
+        )
+        expected = [(student, -average) for average, student in averages]
+        assert book.top_students(subject, 10) == expected[:10]
+        assert book.rank_of(name, subject) == [n for n, _ in expected].index(name) + 1
+        index = max(math.ceil(0.9 * len(expected)), 1) - 1
+        assert book.percentile(subject, 90) == expected[len(expected) - 1 - index][1]
+
+
+@pytest.mark.parametrize("book_class", [IndexedGradebook, ConcurrentGradebook])
+def test_ranking_zero_weight_first_grade(book_class):
+    book = book_class()
+    subject = book.get_student("Albert").get_subject("Math")
+    # 重みの合計が0のうちは順位表に載らない
+    subject.report_grade(90, 0.0)
+    assert book.students_of("Math") == []
+    subject.report_grade(70, 1.0)
+    assert book.top_students("Math", 1) == [("Albert", 70.0)]
+
+
+def test_rank_tree(monkeypatch):
+    # バケツの分割と削除が起きるよう小さくする
+    monkeypatch.setattr(create_class, "RANK_LOAD", 2)
+    rng = random.Random(0)
+    tree = RankTree()
+    keys = []
+    for _ in range(300):
+        if keys and rng.random() < 0.4:
+            key = keys.pop(rng.randrange(len(keys)))
+            tree.remove(key)
+        else:
+            key = (rng.random(), "")
+            keys.append(key)
+            tree.add(key)
+        keys.sort()
+        assert len(tree) == len(keys)
+        assert tree.first(5) == keys[:5]
+        for index, key in enumerate(keys):
+            assert tree.kth(index) == key
+            assert tree.rank(key) == index
+
+
+def test_concurrent_gradebook():
+    book = ConcurrentGradebook(stripes=4)
+    seen = []
+
+    def write():
+        for _ in range(20):
+            for name, subject, score, weight in GRADES:
+                student = book.get_student(name)
+                seen.append((name, student))
+                student.get_subject(subject).report_grade(score, weight)
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # スレッド内のassertは失敗してもテストを落とさないので, ここで確かめる
+    # 同じ名前の学生が複数作られない
+    assert len(seen) == 8 * 20 * len(GRADES)
+    for name, student in seen:
+        assert student is book.get_student(name)
+    expected = fill(Gradebook())
+    averages = book.snapshot_averages()
+    assert averages.keys() == {"Albert Einstein", "Isaac Newton"}
+    for name, average in averages.items():
+        assert average == pytest.approx(expected.get_student(name).average_grade())
+    assert len(book.get_student("Isaac Newton").get_subject("Gym")._grades) == 160
+
+
+@pytest.mark.parametrize(
+    "book_class", [Gradebook, CompactGradebook, SketchedGradebook]
+)
+def test_median_and_quartiles(book_class):
+    rng = random.Random(0)
+    subject = book_class().get_student("Albert Einstein").get_subject("Math")
+    scores = []
+    for _ in range(101):
+        score = rng.randrange(101)
+        scores.append(score)
+        subject.report_grade(score, 1.0)
+        assert subject.median() == get_stats(scores)[3]
+        if len(scores) > 1:
+            expected = statistics.quantiles(scores, n=4, method="inclusive")
+            assert subject.quartiles() == pytest.approx(tuple(expected))
+
+
+def test_quantile_sketch_merge():
+    rng = random.Random(0)
+    book = SketchedGradebook()
+    scores = []
+    for i in range(300):
+        score = rng.randrange(101)
+        scores.append(score)
+        book.get_student(f"student{i % 7}").get_subject("Math").report_grade(score, 1.0)
+    # 生徒ごとのスケッチを併合すると, 教科全体の分位数が正確に求まる
+    sketch = book.subject_sketch("Math")
+    assert sketch.exact
+    assert sketch.quantile(0.9) == pytest.approx(
+        statistics.quantiles(scores, n=10, method="inclusive")[-1]
+    )
+    # 値の種類が上限を超えると近似になるが, 大きくは外れない
+    sketch = QuantileSketch(max_bins=32)
+    values = [rng.random() for _ in range(10_000)]
+    for value in values:
+        sketch.add(value)
+    assert not sketch.exact
+    assert sketch.quantile(0.5) == pytest.approx(statistics.median(values), abs=0.05)
+
+
+@pytest.mark.parametrize(
+    "book_class", [Gradebook, CompactGradebook, ColumnarGradebook]
+)
+def test_save_and_load(tmp_path, book_class):
+    path = tmp_path / "grades.bin"
+    expected = fill(book_class())
+    expected.save(path)
+    book = ColumnarGradebook.load(path)
+    for name in ["Albert Einstein", "Isaac Newton"]:
+        student = book.get_student(name)
+        assert student.average_grade() == expected.get_student(name).average_grade()
+        assert student.recompute_average_grade() == student.average_grade()
+    # 記録すると列が配列にコピーされ, ファイルは変わらない
+    book.get_student("Isaac Newton").get_subject("Math").report_grade(70, 0.5)
+    assert book.get_student("Isaac Newton").get_subject("Math").average_grade() == 80
+    reloaded = ColumnarGradebook.load(path).get_student("Isaac Newton")
+    assert reloaded.get_subject("Math").average_grade() == 90
+
+
+def test_load_unsorted_pairs(tmp_path):
+    # 学生と教科の組が(学生, 教科)の順に記録されていなくても, 並べて保存する
+    path = tmp_path / "grades.bin"
+    expected = ColumnarGradebook()
+    for name, subject, score, weight in reversed(GRADES):
+        expected.get_student(name).get_subject(subject).report_grade(score, weight)
+    expected.save(path)
+    book = ColumnarGradebook.load(path)
+    for name in ["Albert Einstein", "Isaac Newton"]:
+        for subject in ["Math", "Gym"]:
+            assert (
+                book.get_student(name).get_subject(subject).average_grade()
+                == expected.get_student(name).get_subject(subject).average_grade()
+            )
+        assert (
+            book.get_student(name).average_grade()
+            == expected.get_student(name).average_grade()
+        )
+    # 組の索引は書き込むまで作らない
+    assert book.pair_ids == {}
+    with pytest.raises(KeyError):
+        book.get_student("Isaac Newton").get_subject("Art").average_grade()
+    book.get_student("Isaac Newton").get_subject("Gym").report_grade(80, 1.0)
+    assert book.get_student("Isaac Newton").get_subject("Gym").average_grade() == 70
@@ -0,0 +1,98 @@
+import io
+import itertools
+import tracemalloc
+
+import pytest
+
+from src.type_registration import (RECORD_HEADER, EvenBetterPoint2D, Point2D,
+                                   Vector3D, deserialize_binary,
+                                   deserialize_stream, iter_deserialize_binary,
+                                   register_class, serialize_many, type_tag)
+
+
+class UnregisteredPoint2D(EvenBetterPoint2D):
+    pass
+
+
+def test_binary_round_trip():
+    objs = [
+        EvenBetterPoint2D(5, 3),
+        Vector3D(10, -7, 3.5),
+        EvenBetterPoint2D(-1.5, 2**40),
+    ]
+    for obj in objs:
+        after = deserialize_binary(obj.serialize_binary())
+        assert type(after) is type(obj)
+        assert after.args == obj.args
+    data = b"".join(obj.serialize_binary() for obj in objs)
+    assert [after.args for after in iter_deserialize_binary(data)] == [
+        obj.args for obj in objs
+    ]
+    # 型タグと数値の方が, クラス名を含むJSONより小さい
+    assert len(objs[0].serialize_binary()) < len(objs[0].serialize())
+
+
+def test_binary_rejects_other_args():
+    with pytest.raises(TypeError):
+        EvenBetterPoint2D("5", 3).serialize_binary()
+    with pytest.raises(TypeError):
+        UnregisteredPoint2D(5, 3).serialize_binary()
+
+
+def test_binary_type_tags_by_name():
+    data = EvenBetterPoint2D(5, 3).serialize_binary()
+    # 型タグはクラス名だけで決まり, 後から登録したクラスで変わらない
+    assert RECORD_HEADER.unpack_from(data)[0] == type_tag("EvenBetterPoint2D")
+
+    class LaterPoint2D(EvenBetterPoint2D):
+        pass
+
+    register_class(LaterPoint2D)
+    assert EvenBetterPoint2D(5, 3).serialize_binary() == data
+    after = deserialize_binary(LaterPoint2D(1, 2).serialize_binary())
+    assert type(after) is LaterPoint2D
+
+
+def test_ndjson_stream():
+    objs = [EvenBetterPoint2D(i, i / 2) for i in range(1000)] + [Vector3D(1, -2, 3)]
+    fileobj = io.StringIO()
+    assert serialize_many(objs, fileobj, chunk_size=100) == len(objs)
+    lines = fileobj.getvalue().splitlines()
+    assert lines == [obj.serialize() for obj in objs]
+    # 空行や書式の違う行があっても1行ずつ読み直す
+    lines[10:10] = ["", '{"args": [1, 2], "class": "EvenBetterPoint2D"}']
+    after = list(deserialize_stream(io.StringIO("\n".join(lines)), chunk_size=100))
+    assert [type(obj) for obj in after] == [EvenBetterPoint2D] * 1001 + [Vector3D]
+    assert after[10].args == (1, 2)
+    assert [obj.args for obj in after[:10]] == [obj.args for obj in objs[:10]]
+
+
+def test_ndjson_unregistered_classes():
+    # 登録されていないクラスはserialize()の結果を1行ずつ書く
+    objs = [EvenBetterPoint2D(1, 2), UnregisteredPoint2D(3, 4), Point2D(5, 6)]
+    fileobj = io.StringIO()
+    assert serialize_many(objs, fileobj) == len(objs)
+    assert fileobj.getvalue().splitlines() == [obj.serialize() for obj in objs]
+
+
+def test_ndjson_stream_memory():
+    def lines():
+        for i in range(50_000):
+            yield EvenBetterPoint2D(i, i).serialize() + "\n"
+
+    class LineFile(io.TextIOBase):
+        def __init__(self):
+            self._lines = lines()
+
+        def readlines(self, hint=-1):
+            return list(itertools.islice(self._lines, max(hint // 40, 1)))
+
+    # ストリームの長さによらず, 1チャンク分のメモリしか使わない
+    tracemalloc.start()
+    try:
+        count = sum(1 for _ in deserialize_stream(LineFile(), chunk_size=4096))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert count == 50_000
+    assert peak < 1_000_000
@@ -0,0 +1,464 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.use_classmethod import (AsyncPathInputData, CompressedPathInputData,
+                                 GenericWorker, HTTPInputData, JobStats,
+                                 LineCountWorker, LineLengthHistogramWorker,
+                                 PathInputData, SerialExecutor,
+                                 ShardedPathInputData, WordCountWorker,
+                                 compare_benchmarks, compress_dataset,
+                                 count_newlines, dataset_line_counts,
+                                 discover_files, execute, mapreduce,
+                                 mapreduce_async, mapreduce_cluster,
+                                 mapreduce_keyed, mapreduce_shared, read_pairs,
+                                 run_benchmark, write_dataset)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for i in range(10):
+        with open(os.path.join(tmp_path, str(i)), "w") as f:
+            f.write("\n" * i)
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("executor", ["serial", "thread", "process"])
+def test_mapreduce_executor(data_dir, executor):
+    config = {"data_dir": data_dir}
+    assert mapreduce(LineCountWorker, PathInputData, config, executor) == 45
+
+
+def test_mapreduce_executor_instance(data_dir):
+    config = {"data_dir": data_dir}
+    assert mapreduce(LineCountWorker, PathInputData, config, SerialExecutor()) == 45
+
+
+def test_mapreduce_unknown_executor(data_dir):
+    with pytest.raises(ValueError):
+        mapreduce(LineCountWorker, PathInputData, {"data_dir": data_dir}, "gpu")
+
+
+def test_mapreduce_empty_dir(tmp_path):
+    config = {"data_dir": str(tmp_path)}
+    assert mapreduce(LineCountWorker, PathInputData, config) is None
+
+
+class ActiveCountWorker(LineCountWorker):
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def map(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        time.sleep(0.01)
+        super().map()
+        with cls.lock:
+            cls.active -= 1
+
+
+def test_execute_bounded_in_flight(data_dir):
+    workers = ActiveCountWorker.generate_workers(PathInputData, {"data_dir": data_dir})
+    assert execute(workers, "thread", max_workers=8, max_in_flight=2) == 45
+    assert ActiveCountWorker.peak <= 2
+
+
+def test_read_chunks(tmp_path):
+    path = os.path.join(tmp_path, "data")
+    with open(path, "wb") as f:
+        f.write(b"ab\ncd\n" * 10)
+    chunks = [bytes(c) for c in PathInputData(path).read_chunks(chunk_size=4)]
+    assert all(len(c) <= 4 for c in chunks)
+    assert b"".join(chunks) == b"ab\ncd\n" * 10
+    worker = LineCountWorker(PathInputData(path))
+    worker.map()
+    assert worker.result == 20
+    # ブロックはバッファ全体なので, count_newlines()はコピーせずに数えられる
+    for input_data in [PathInputData(path), ShardedPathInputData(path, 0, 15)]:
+        for chunk in input_data.read_chunks(chunk_size=4):
+            assert chunk.nbytes == len(chunk.obj)
+    # バッファの途中から始まるviewでも正しく数える
+    buffer = b"\n\nab\ncd"
+    assert count_newlines(memoryview(buffer)[2:]) == 1
+    assert count_newlines(memoryview(bytearray(buffer))[:1]) == 1
+
+
+def test_sharded_path_input_data(tmp_path):
+    path = os.path.join(tmp_path, "data")
+    content = b"".join(b"x" * i + b"\n" for i in range(50))
+    with open(path, "wb") as f:
+        f.write(content)
+    shards = list(ShardedPathInputData.split(path, 100))
+    assert len(shards) > 1
+    assert shards[0].start == 0 and shards[-1].end == len(content)
+    for shard in shards:
+        assert content[shard.end - 1 : shard.end] == b"\n"
+    config = {"data_dir": str(tmp_path), "shard_size": "100"}
+    assert mapreduce(LineCountWorker, ShardedPathInputData, config) == 50
+
+
+@pytest.mark.parametrize("executor", ["serial", "process"])
+def test_mapreduce_keyed(tmp_path, monkeypatch, executor):
+    monkeypatch.setattr("src.use_classmethod.MERGE_FAN_IN", 2)
+    data_dir = tmp_path / "data"
+    spill_dir = tmp_path / "spill"
+    data_dir.mkdir()
+    spill_dir.mkdir()
+    expected = Counter()
+    for i in range(5):
+        words = [f"w{j % (i + 3)}" for j in range(40)]
+        expected.update(words)
+        (data_dir / str(i)).write_text(" ".join(words))
+    config = {
+        "data_dir": str(data_dir),
+        "spill_dir": str(spill_dir),
+        "partitions": "3",
+        "max_keys": "2",
+    }
+    outputs = mapreduce_keyed(WordCountWorker, PathInputData, config, executor)
+    assert len(outputs) == 3
+    counts = Counter()
+    for path in outputs:
+        keys = [key for key, _ in read_pairs(path)]
+        assert keys == sorted(keys)
+        counts.update(dict(read_pairs(path)))
+    assert counts == expected
+    assert sorted(os.listdir(spill_dir)) == [os.path.basename(p) for p in outputs]
+
+
+class ConcatWorker(GenericWorker):
+    def map(self):
+        time.sleep(random.random() / 100)
+        self.result = [self.input_data]
+
+    def reduce(self, other):
+        self.result = self.result + other.result
+
+
+@pytest.mark.parametrize("count", [1, 2, 7, 16, 33])
+def test_execute_tree_reduction_order(count):
+    workers = (ConcatWorker(i) for i in range(count))
+    assert execute(workers, "thread", max_workers=4) == list(range(count))
+
+
+class CountingLineCountWorker(LineCountWorker):
+    mapped = 0
+
+    def map(self):
+        type(self).mapped += 1
+        super().map()
+
+
+def test_mapreduce_cache(data_dir, tmp_path_factory):
+    cache_path = str(tmp_path_factory.mktemp("cache") / "cache")
+    config = {"data_dir": data_dir, "cache_path": cache_path}
+    worker_class = CountingLineCountWorker
+    assert mapreduce(worker_class, PathInputData, config, "serial") == 45
+    assert worker_class.mapped == 10
+
+    assert mapreduce(worker_class, PathInputData, config, "serial") == 45
+    assert worker_class.mapped == 10
+
+    with open(os.path.join(data_dir, "3"), "w") as f:
+        f.write("\n" * 100)
+    os.remove(os.path.join(data_dir, "9"))
+    assert mapreduce(worker_class, PathInputData, config, "serial") == 133
+    assert worker_class.mapped == 11
+
+
+def test_discover_files(tmp_path):
+    for relpath, size in [
+        ("a.log", 1),
+        ("b.txt", 5),
+        ("sub/c.log", 3),
+        ("sub/deep/d.log", 9),
+        ("skip/e.log", 7),
+    ]:
+        path = tmp_path / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n" * size)
+    config = {"data_dir": str(tmp_path)}
+    assert sorted(e.name for e in discover_files(config)) == ["a.log", "b.txt"]
+
+    config.update(recursive="true", include="*.log", exclude="skip")
+    config.update(order="largest_first")
+    names = [e.name for e in discover_files(config)]
+    assert names == ["d.log", "c.log", "a.log"]
+    assert mapreduce(LineCountWorker, PathInputData, config) == 13
+
+    # ディレクトリへのシンボリックリンクはたどらないので, 循環しても終わる
+    (tmp_path / "sub" / "loop").symlink_to(tmp_path / "sub")
+    assert [e.name for e in discover_files(config)] == names
+
+
+def test_mapreduce_async_path(data_dir):
+    config = {"data_dir": data_dir}
+    coro = mapreduce_async(LineCountWorker, AsyncPathInputData, config)
+    assert asyncio.run(coro) == 45
+    # 同期のmapreduce()に渡すと, 読み込む前に分かりやすいエラーにする
+    with pytest.raises(TypeError):
+        mapreduce(LineCountWorker, AsyncPathInputData, config)
+
+
+def test_mapreduce_async_http(data_dir):
+    handler = partial(SimpleHTTPRequestHandler, directory=data_dir)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        port = server.server_address[1]
+        urls = ",".join(f"http://127.0.0.1:{port}/{i}" for i in range(10))
+        coro = mapreduce_async(
+            LineCountWorker, HTTPInputData, {"urls": urls}, max_concurrency=3
+        )
+        assert asyncio.run(coro) == 45
+
+        missing = {"urls": f"http://127.0.0.1:{port}/missing"}
+        with pytest.raises(OSError):
+            asyncio.run(mapreduce_async(LineCountWorker, HTTPInputData, missing))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_input_data_errors():
+    with pytest.raises(ValueError):
+        HTTPInputData("https://127.0.0.1/")
+    # 接続は受け付けるが応答しないサーバー
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        port = server.getsockname()[1]
+        input_data = HTTPInputData(f"http://127.0.0.1:{port}/", timeout=0.2)
+        with pytest.raises(TimeoutError):
+            asyncio.run(input_data.read())
+
+
+@pytest.mark.parametrize("executor", ["serial", "process"])
+def test_mapreduce_stats(data_dir, executor):
+    stats = JobStats()
+    config = {"data_dir": data_dir}
+    result = mapreduce(LineCountWorker, PathInputData, config, executor, stats=stats)
+    assert result == 45
+    report = json.loads(stats.to_json(include_workers=True))
+    assert report["maps"] == 10
+    assert report["bytes_read"] == 45
+    assert set(report["phases"]) == {"listing", "reading", "mapping", "reducing"}
+    assert set(report["wall_time"]) == {"p50", "p90", "p99", "p100"}
+    assert report["wall_time"]["p50"] <= report["wall_time"]["p100"]
+    assert sorted(w["bytes_read"] for w in report["workers"]) == list(range(10))
+
+
+class PathLengthWorker(GenericWorker):
+    def map(self):
+        data = self.input_data.read()
+        self.result = len(os.path.basename(self.input_data.path)) + len(data)
+
+    def reduce(self, other):
+        self.result += other.result
+
+
+def test_stats_keep_input_attributes(tmp_path):
+    (tmp_path / "ab").write_text("\u3042")
+    stats = JobStats()
+    config = {"data_dir": str(tmp_path)}
+    # 計測中もpathなどの入力の属性を読め, 文字数ではなくバイト数を数える
+    assert mapreduce(PathLengthWorker, PathInputData, config, stats=stats) == 3
+    assert json.loads(stats.to_json())["bytes_read"] == 3
+
+
+@pytest.mark.parametrize("distribution", ["uniform", "zipf", "giant"])
+def test_dataset_line_counts(distribution):
+    counts = dataset_line_counts(10, 1000, distribution, seed=1)
+    assert len(counts) == 10 and sum(counts) == 1000
+    if distribution == "giant":
+        assert max(counts) >= 900
+    assert dataset_line_counts(0, 1000, distribution) == []
+    assert dataset_line_counts(1, 1000, distribution) == [1000]
+
+
+def test_write_dataset_deterministic(tmp_path):
+    contents = []
+    for executor in ["serial", "process"]:
+        data_dir = tmp_path / executor
+        lines = write_dataset(
+            str(data_dir), 6, 500, "zipf", depth=2, fanout=2, executor=executor
+        )
+        assert lines == 500
+        files = sorted(p for p in data_dir.rglob("*") if p.is_file())
+        assert len(files) == 6
+        assert all(len(p.relative_to(data_dir).parts) == 3 for p in files)
+        contents.append([p.read_bytes() for p in files])
+    assert contents[0] == contents[1]
+
+
+def test_run_benchmark(tmp_path):
+    data_dir = tmp_path / "data"
+    lines = write_dataset(str(data_dir), 4, 200, depth=1, executor="serial")
+    config = {"data_dir": str(data_dir), "recursive": "true", "shard_size": "256"}
+    output_path = str(tmp_path / "bench.json")
+    results = run_benchmark(
+        config, ["serial", "thread"], repeat=1, output_path=output_path
+    )
+    assert len(results["cases"]) == 4
+    assert all(case["result"] == lines for case in results["cases"])
+    ratios = compare_benchmarks(output_path, output_path)
+    assert set(ratios.values()) == {1.0}
+
+
+class StragglerWorker(LineCountWorker):
+    attempts = Counter()
+
+    def map(self):
+        name = os.path.basename(self.input_data.path)
+        type(self).attempts[name] += 1
+        # 最初の試行だけ遅い
+        time.sleep(1.0 if name == "0" and self.attempts[name] == 1 else 0.01)
+        super().map()
+
+
+def test_execute_speculative(data_dir):
+    config = {"data_dir": data_dir, "speculative": "true"}
+    start = time.perf_counter()
+    assert mapreduce(StragglerWorker, PathInputData, config, max_workers=4) == 45
+    assert time.perf_counter() - start < 0.8
+    assert StragglerWorker.attempts["0"] == 2
+    assert sum(StragglerWorker.attempts.values()) == 11
+
+
+class SlowReduceStragglerWorker(LineCountWorker):
+    attempts = Counter()
+
+    def map(self):
+        name = os.path.basename(self.input_data.path)
+        type(self).attempts[name] += 1
+        # 最初の試行だけ遅く, 集計が終わる前に目を覚ます
+        time.sleep(0.5 if name == "0" and self.attempts[name] == 1 else 0.01)
+        super().map()
+
+    def reduce(self, other):
+        time.sleep(0.2)
+        super().reduce(other)
+
+
+def test_execute_speculative_loser_wakes_up(data_dir):
+    # 遅い入力を木の左端に置き, 他の結果がそのノードに集計されるようにする
+    paths = [os.path.join(data_dir, str(i)) for i in range(10)]
+    workers = [SlowReduceStragglerWorker(PathInputData(path)) for path in paths]
+    start = time.perf_counter()
+    result = execute(workers, "thread", max_workers=4, speculative=True)
+    # 負けた試行が集計中の木のノードを書き換えない
+    assert time.perf_counter() - start > 0.5
+    assert result == 45
+    assert SlowReduceStragglerWorker.attempts["0"] == 2
+
+
+def test_mapreduce_cluster(data_dir):
+    config = {"data_dir": data_dir}
+    result = mapreduce_cluster(LineCountWorker, PathInputData, config, local_nodes=2)
+    assert result == 45
+
+
+class CrashOnceWorker(LineCountWorker):
+    def map(self):
+        # 最初にこの入力を受け取ったノードはプロセスごと落ちる
+        marker = self.input_data.path + ".crashed"
+        if os.path.basename(self.input_data.path) == "5":
+            try:
+                os.close(os.open(marker, os.O_CREAT | os.O_EXCL))
+            except FileExistsError:
+                pass
+            else:
+                os._exit(1)
+        super().map()
+
+
+def test_mapreduce_cluster_node_loss(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for i in range(10):
+        (data_dir / str(i)).write_text("\n" * i)
+    config = {"data_dir": str(data_dir), "include": "[0-9]"}
+    result = mapreduce_cluster(
+        CrashOnceWorker, PathInputData, config, local_nodes=2, node_timeout=2.0
+    )
+    assert result == 45
+
+
+class NotIdempotentWorker(LineCountWorker):
+    idempotent = False
+
+
+class SlowMapWorker(NotIdempotentWorker):
+    def map(self):
+        if os.path.basename(self.input_data.path) == "0":
+            time.sleep(3)
+        super().map()
+
+
+def test_mapreduce_cluster_slow_map(data_dir):
+    # 長いmapも, ノードが生存を通知している間は失われたとみなさない
+    config = {"data_dir": data_dir}
+    result = mapreduce_cluster(
+        SlowMapWorker, PathInputData, config, local_nodes=4, node_timeout=2.0
+    )
+    assert result == 45
+
+
+def test_mapreduce_cluster_without_nodes(data_dir):
+    config = {"data_dir": data_dir}
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        mapreduce_cluster(
+            LineCountWorker, PathInputData, config, queue_timeout=0.2, max_attempts=2
+        )
+    # 生きたノードがなければ, 開始されないタスクをmax_attempts回まで投入して諦める
+    assert time.perf_counter() - start < 5
+    with pytest.raises(TimeoutError):
+        mapreduce_cluster(NotIdempotentWorker, PathInputData, config, queue_timeout=0.2)
+
+
+@pytest.mark.parametrize("codec", ["gzip", "bz2", "xz"])
+def test_compressed_path_input_data(data_dir, tmp_path_factory, codec):
+    output_dir = str(tmp_path_factory.mktemp(codec))
+    compress_dataset(data_dir, output_dir, codec)
+    config = {"data_dir": output_dir}
+    assert mapreduce(LineCountWorker, CompressedPathInputData, config, "process") == 45
+
+    # 同じファイルでも入力クラスが違えば, キャッシュした結果を共有しない
+    config["cache_path"] = str(tmp_path_factory.mktemp("cache") / "cache")
+    assert mapreduce(LineCountWorker, PathInputData, config) != 45
+    assert mapreduce(LineCountWorker, CompressedPathInputData, config) == 45
+
+    # 拡張子がなくてもマジックバイトで判定する
+    path = os.path.join(output_dir, os.listdir(output_dir)[0])
+    os.rename(path, path + ".bin")
+    assert CompressedPathInputData(path + ".bin").read() == PathInputData(
+        os.path.join(data_dir, os.path.basename(path).split(".")[0])
+    ).read()
+
+
+@pytest.mark.parametrize("executor", ["serial", "thread", "process"])
+def test_mapreduce_shared(data_dir, executor):
+    config = {"data_dir": data_dir}
+    result = mapreduce_shared(LineCountWorker, PathInputData, config, executor)
+    assert result == [45]
+
+    histogram = mapreduce_shared(
+        LineLengthHistogramWorker, PathInputData, config, executor, max_in_flight=3
+    )
+    assert len(histogram) == LineLengthHistogramWorker.width
+    assert histogram == mapreduce(LineLengthHistogramWorker, PathInputData, config)
+    assert histogram[0] == 45